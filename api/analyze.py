@@ -1,4 +1,6 @@
 from http.server import BaseHTTPRequestHandler
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
 import json
 import sys
 import os
@@ -6,69 +8,77 @@ import os
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from trading_strategy import TradingStrategy
+# Only NumPy is loaded at cold start, the data provider is imported on first use
+from strategy_core import analyze_closes
 
-def analyze_strategy(initial_investment, shares_per_trade, consecutive_days, stock_symbol):
-    try:
-        # Create strategy instance
-        strategy = TradingStrategy(
-            initial_investment=float(initial_investment),
-            shares_per_trade=int(shares_per_trade),
-            consecutive_days=int(consecutive_days),
-            stock_symbol=stock_symbol
-        )
-        
-        # Run analysis
-        results = strategy.analyze()
-        
-        # Format results
-        return {
-            'initial_investment': f"${float(initial_investment):,.2f}",
-            'final_value': f"${results['final_value']:,.2f}",
-            'total_return': f"{results['total_return']:.2f}%",
-            'sp500_return': f"{results['sp500_return']:.2f}%",
-            'number_of_trades': results['number_of_trades'],
-            'last_trades': results['last_trades'],
-            'plot_html': results['plot_html']
-        }
-    except Exception as e:
-        return {'error': str(e)}
+# Seconds that fetching the stock and the S&P 500 may take together
+FETCH_DEADLINE = 6.0
+
+REQUIRED_PARAMETERS = ['initial_investment', 'shares_small_move', 'shares_large_move', 'consecutive_days', 'stock_symbol']
+
+def parse_form(content_type, body):
+    """Parse a urlencoded or JSON request body into a dict of strings"""
+    if content_type.startswith('application/json'):
+        return {name: str(value) for name, value in json.loads(body or b'{}').items()}
+    return {name: values[-1] for name, values in parse_qs(body.decode()).items()}
+
+def closes(df):
+    """Return the dates and closing prices of a price frame as NumPy arrays"""
+    index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    return index.values, df['Close'].to_numpy(dtype='float64')
+
+def analyze_strategy(form):
+    """Fetch prices and run the strategy without plotting"""
+    missing = [name for name in REQUIRED_PARAMETERS if not form.get(name)]
+    if missing:
+        return {'error': f'Missing parameter: {missing[0]}'}
+
+    stock_symbol = form['stock_symbol'].upper()
+    if form.get('start_date') and form.get('end_date'):
+        start_date = datetime.strptime(form['start_date'], '%Y-%m-%d')
+        end_date = datetime.strptime(form['end_date'], '%Y-%m-%d')
+    else:
+        # Default to 5 years if no dates provided
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=5*365)
+
+    from price_data import default_provider, fetch_deadline
+    provider = default_provider()
+    # Both fetches share one time budget, retries included
+    with fetch_deadline(FETCH_DEADLINE):
+        stock_df = provider.fetch(stock_symbol, start_date, end_date)
+        if stock_df is None or stock_df.empty:
+            return {'error': f'No data available for {stock_symbol}'}
+        sp500_df = provider.fetch('^GSPC', start_date, end_date)
+        if sp500_df is None or sp500_df.empty:
+            return {'error': 'Unable to fetch S&P 500 data'}
+
+    dates, close = closes(stock_df)
+    return analyze_closes(
+        dates, close, closes(sp500_df)[1],
+        initial_investment=float(form['initial_investment']),
+        shares_small_move=int(form['shares_small_move']),
+        shares_large_move=int(form['shares_large_move']),
+        consecutive_days=int(form['consecutive_days']),
+        large_move_threshold=float(form.get('large_move_threshold') or 5)
+    )
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             # Get form data
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            form_data = dict(item.split('=') for item in post_data.decode().split('&'))
-            
-            # Extract parameters
-            initial_investment = form_data.get('initial_investment')
-            shares_per_trade = form_data.get('shares_per_trade')
-            consecutive_days = form_data.get('consecutive_days')
-            stock_symbol = form_data.get('stock_symbol')
-            
-            # Validate parameters
-            if not all([initial_investment, shares_per_trade, consecutive_days, stock_symbol]):
-                raise ValueError("Missing required parameters")
-            
+            content_length = int(self.headers.get('Content-Length') or 0)
+            form = parse_form(self.headers.get('Content-Type', ''), self.rfile.read(content_length))
+
             # Run analysis
-            results = analyze_strategy(
-                initial_investment=initial_investment,
-                shares_per_trade=shares_per_trade,
-                consecutive_days=consecutive_days,
-                stock_symbol=stock_symbol
-            )
-            
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(results).encode())
-            
+            results = analyze_strategy(form)
+            status = 400 if 'error' in results else 200
         except Exception as e:
-            # Send error response
-            self.send_response(400)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode()) 
\ No newline at end of file
+            results = {'error': str(e)}
+            status = 400
+
+        # Send response
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(results).encode())
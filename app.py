@@ -1,10 +1,21 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, make_response, send_file, stream_with_context, url_for
 from trading_strategy import TradingStrategy
+from sweep import PARAMETERS, run_sweep, create_sweep_heatmap
+from batch import analyze_batch
+from montecarlo import MAX_PATHS, create_monte_carlo_plot, run_monte_carlo, summarize_monte_carlo
+from result_cache import RESULT_CACHE, analysis_key, make_result_id, parse_result_id
+from plot_payload import PLOTLY_JS_PATH, plotly_js_version
+from jobs import JobManager, JobQueueFull
+import instrumentation
+from instrumentation import REGISTRY, REQUEST_SECONDS, span
 import os
-import pandas as pd
-from io import BytesIO
 from datetime import datetime, timedelta
+import itertools
+import json
 import logging
+import re
+import tempfile
+import time
 
 app = Flask(__name__)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
@@ -14,75 +25,440 @@ app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Background workers for long-running analyses submitted to /jobs, with
+# job state in a directory every worker process on the host can read
+JOBS = JobManager(
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_queued=int(os.environ.get('JOB_QUEUE_SIZE', 64)),
+    state_dir=os.environ.get('JOB_STATE_DIR') or os.path.join(tempfile.gettempdir(), 'kailash-jobs')
+)
+
+@app.before_request
+def start_timing():
+    if instrumentation.enabled():
+        g.started_at = time.perf_counter()
+        instrumentation.begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    started_at = g.get('started_at')
+    if started_at is None:
+        return response
+    total = time.perf_counter() - started_at
+    spans = instrumentation.end_request()
+    response.headers['Server-Timing'] = instrumentation.server_timing(spans, total)
+    REQUEST_SECONDS.observe(total, request.endpoint or 'unmatched', str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    if not instrumentation.enabled():
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(REGISTRY.expose(), content_type=REGISTRY.CONTENT_TYPE)
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', plotly_js_version=plotly_js_version())
+
+@app.route('/plotly.min.js')
+def plotly_js():
+    # The URL carries the plotly.js version, so browsers can cache it for good
+    return send_file(PLOTLY_JS_PATH, mimetype='application/javascript', max_age=365 * 24 * 3600, conditional=True)
+
+def wants_json():
+    """Whether the client asked for JSON rather than the HTML page"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def render_results(results=None, error=None):
+    """Render analysis results or an error as JSON or HTML, as the client prefers"""
+    with span('render'):
+        if wants_json():
+            return jsonify(results if error is None else {'error': error})
+        return render_template('index.html', results=results, error=error, plotly_js_version=plotly_js_version())
+
+def strategy_from_form(form):
+    """Create a strategy instance from the analysis form fields"""
+    plot_mode = form.get('plot_mode', 'lite')
+    if plot_mode not in ('inline', 'lite'):
+        raise ValueError(f"Unknown plot mode '{plot_mode}'")
+    return TradingStrategy(
+        initial_investment=float(form['initial_investment']),
+        shares_small_move=int(form['shares_small_move']),
+        shares_large_move=int(form['shares_large_move']),
+        consecutive_days=int(form['consecutive_days']),
+        stock_symbol=form['stock_symbol'].upper(),
+        start_date=form.get('start_date'),
+        end_date=form.get('end_date'),
+        large_move_threshold=float(form.get('large_move_threshold') or 5),
+        plot_mode=plot_mode
+    )
+
+def analyze_and_store(strategy, key, stock_data, sp500_data, progress=None):
+    """Return the stored analysis for key, running and storing it if needed
+
+    Returns (entry, error) where entry holds the results and the ledger.
+    """
+    entry = RESULT_CACHE.get(key)
+    if entry is not None:
+        logger.info("Serving cached analysis")
+        return entry, None
+    
+    results = strategy.analyze(stock_data, sp500_data, progress=progress)
+    if 'error' in results:
+        return None, results['error']
+    
+    # The full ledger stays on the server, clients download it by result ID
+    results['result_id'] = make_result_id(key, strategy)
+    entry = {'results': results, 'ledger': strategy.get_trade_ledger()}
+    RESULT_CACHE.set(key, entry)
+    return entry, None
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
-        # Get form data
+        # Create strategy instance from the form data
+        try:
+            strategy = strategy_from_form(request.form)
+        except ValueError as e:
+            return render_results(error=str(e))
+        
+        logger.info(f"Starting analysis for {strategy.stock_symbol}")
+        
+        stock_data, sp500_data, error = strategy.get_historical_data()
+        if error:
+            logger.error(f"Strategy returned error: {error}")
+            return render_results(error=error)
+        
+        # Identical parameters over identical prices give an identical result
+        with span('fingerprint'):
+            key = analysis_key(strategy, stock_data, sp500_data)
+        etag = f"{key}-{'json' if wants_json() else 'html'}"
+        # The client's copy is only current while its result can still be downloaded here
+        if request.if_none_match.contains(etag) and RESULT_CACHE.get(key) is not None:
+            logger.info("Analysis not modified")
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        # Run analysis
+        try:
+            entry, error = analyze_and_store(strategy, key, stock_data, sp500_data)
+        except Exception as e:
+            logger.error(f"Error during strategy analysis: {str(e)}")
+            return render_results(error=f"Error during analysis: {str(e)}")
+        
+        if error:
+            logger.error(f"Strategy returned error: {error}")
+            return render_results(error=error)
+            
+        logger.info("Analysis completed successfully")
+        response = make_response(render_results(results=entry['results']))
+        response.set_etag(etag)
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error in analyze route: {str(e)}")
+        return render_results(error=f"An error occurred: {str(e)}")
+
+def run_analysis_job(strategy, report):
+    """Fetch, simulate and plot one analysis on a job worker"""
+    report('fetching')
+    stock_data, sp500_data, error = strategy.get_historical_data()
+    if error:
+        raise ValueError(error)
+    
+    key = analysis_key(strategy, stock_data, sp500_data)
+    entry, error = analyze_and_store(strategy, key, stock_data, sp500_data, progress=report)
+    if error:
+        raise ValueError(error)
+    return entry['results']
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        strategy = strategy_from_form(request.form)
+        job = JOBS.submit(lambda report: run_analysis_job(strategy, report))
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except KeyError as e:
+        return jsonify({'error': f"Missing parameter: {e.args[0]}"}), 400
+    except ValueError as e:
+        return jsonify({'error': f"Invalid parameters: {str(e)}"}), 400
+    
+    logger.info(f"Queued analysis job {job.id} for {strategy.stock_symbol}")
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        # Send every stage as a Server-Sent Event until the job finishes
+        sent = 0
+        while True:
+            events, finished = job.wait_events(sent, timeout=15)
+            if not events and not finished:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if finished and sent == len(job.events):
+                yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+def parse_values(text, cast=int):
+    """Parse a list of values like '2,3,5' or an inclusive integer range like '1-10'"""
+    values = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if cast is int and '-' in part[1:]:
+            low, high = part.split('-', 1)
+            values.extend(range(int(low), int(high) + 1))
+        else:
+            values.append(cast(part))
+    if not values:
+        raise ValueError(f"No values given in '{text}'")
+    return values
+
+@app.route('/sweep', methods=['POST'])
+def sweep():
+    try:
+        # Get form data, each parameter is a list or range of values
         initial_investment = float(request.form['initial_investment'])
-        shares_small_move = int(request.form['shares_small_move'])
-        shares_large_move = int(request.form['shares_large_move'])
-        consecutive_days = int(request.form['consecutive_days'])
+        consecutive_days = parse_values(request.form['consecutive_days'])
+        shares_small_move = parse_values(request.form['shares_small_move'])
+        shares_large_move = parse_values(request.form['shares_large_move'])
+        large_move_thresholds = parse_values(request.form.get('large_move_threshold', '5'), float)
         stock_symbol = request.form['stock_symbol'].upper()
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
+        heatmap_x = request.form.get('heatmap_x', 'shares_small_move')
+        heatmap_y = request.form.get('heatmap_y', 'shares_large_move')
+        top = int(request.form.get('top', 50))
+        if heatmap_x not in PARAMETERS or heatmap_y not in PARAMETERS:
+            return jsonify({'error': f'Heatmap axes must be one of {", ".join(PARAMETERS)}'})
         
-        logger.info(f"Starting analysis for {stock_symbol}")
+        logger.info(f"Starting parameter sweep for {stock_symbol}")
         
-        # Create strategy instance
+        # Load the price series once for the whole grid
         strategy = TradingStrategy(
             initial_investment=initial_investment,
-            shares_small_move=shares_small_move,
-            shares_large_move=shares_large_move,
-            consecutive_days=consecutive_days,
+            shares_small_move=shares_small_move[0],
+            shares_large_move=shares_large_move[0],
+            consecutive_days=consecutive_days[0],
             stock_symbol=stock_symbol,
             start_date=start_date,
             end_date=end_date
         )
+        stock_data, _, error = strategy.get_historical_data()
+        if error:
+            return jsonify({'error': error})
         
-        # Run analysis with timeout
+        table = run_sweep(
+            stock_data['Close'].to_numpy(),
+            initial_investment,
+            consecutive_days,
+            shares_small_move,
+            shares_large_move,
+            large_move_thresholds
+        )
+        
+        logger.info(f"Sweep of {len(table)} combinations completed successfully")
+        return jsonify({
+            'number_of_combinations': len(table),
+            'results': table.head(top).to_dict(orient='records'),
+            'heatmap_html': create_sweep_heatmap(table, heatmap_x, heatmap_y)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in sweep route: {str(e)}")
+        return jsonify({'error': f"An error occurred: {str(e)}"})
+
+@app.route('/monte_carlo', methods=['POST'])
+def monte_carlo():
+    try:
+        # Create strategy instance from the form data
         try:
-            results = strategy.analyze()
-        except Exception as e:
-            logger.error(f"Error during strategy analysis: {str(e)}")
-            return render_template('index.html', error=f"Error during analysis: {str(e)}")
+            strategy = strategy_from_form(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)})
+        n_paths = int(request.form.get('n_paths', 1000))
+        block_size = int(request.form.get('block_size', 20))
+        shuffle_regimes = request.form.get('shuffle_regimes', 'false').lower() in ('1', 'true', 'on', 'yes')
+        seed = request.form.get('seed')
+        seed = int(seed) if seed else None
+        if not 0 < n_paths <= MAX_PATHS:
+            return jsonify({'error': f'The number of paths must be between 1 and {MAX_PATHS}'})
         
-        if 'error' in results:
-            logger.error(f"Strategy returned error: {results['error']}")
-            return render_template('index.html', error=results['error'])
-            
-        logger.info("Analysis completed successfully")
-        return render_template('index.html', results=results)
+        logger.info(f"Starting Monte Carlo analysis of {n_paths} paths for {strategy.stock_symbol}")
+        
+        stock_data, _, error = strategy.get_historical_data()
+        if error:
+            return jsonify({'error': error})
+        if len(stock_data) <= strategy.consecutive_days + 1:
+            return jsonify({'error': f'Not enough data for {strategy.consecutive_days} consecutive days'})
+        
+        with span('simulate'):
+            paths, bands = run_monte_carlo(
+                stock_data['Close'].to_numpy(),
+                strategy.initial_investment,
+                strategy.shares_small_move,
+                strategy.shares_large_move,
+                strategy.consecutive_days,
+                strategy.large_move_threshold,
+                n_paths=n_paths,
+                block_size=block_size,
+                shuffle_regimes=shuffle_regimes,
+                seed=seed
+            )
+        
+        # The real history, drawn on top of the bands
+        with span('plot'):
+            historical = strategy.calculate_portfolio_value_over_time(stock_data)['pct_change']
+            historical = historical.iloc[:len(stock_data) - strategy.consecutive_days].reset_index(drop=True)
+            plot_html = create_monte_carlo_plot(bands, historical)
+        
+        logger.info("Monte Carlo analysis completed successfully")
+        return jsonify({
+            'number_of_paths': len(paths),
+            'historical_return': float(historical.iloc[-1]),
+            'distributions': summarize_monte_carlo(paths),
+            'plot_html': plot_html
+        })
         
     except Exception as e:
-        logger.error(f"Error in analyze route: {str(e)}")
-        return render_template('index.html', error=f"An error occurred: {str(e)}")
+        logger.error(f"Error in Monte Carlo route: {str(e)}")
+        return jsonify({'error': f"An error occurred: {str(e)}"})
 
-@app.route('/download_trades', methods=['POST'])
-def download_trades():
+@app.route('/batch', methods=['POST'])
+def batch():
     try:
-        # Get trades data from request
-        trades = request.json.get('trades', [])
+        # Get form data, symbols are separated by commas or whitespace
+        symbols = [symbol for symbol in re.split(r'[\s,]+', request.form['stock_symbols']) if symbol]
+        initial_investment = float(request.form['initial_investment'])
+        shares_small_move = int(request.form['shares_small_move'])
+        shares_large_move = int(request.form['shares_large_move'])
+        consecutive_days = int(request.form['consecutive_days'])
+        large_move_threshold = float(request.form.get('large_move_threshold', 5))
+        start_date = request.form.get('start_date')
+        end_date = request.form.get('end_date')
+        
+        logger.info(f"Starting batch analysis of {len(symbols)} symbols")
+        rows = analyze_batch(
+            symbols,
+            initial_investment=initial_investment,
+            shares_small_move=shares_small_move,
+            shares_large_move=shares_large_move,
+            consecutive_days=consecutive_days,
+            start_date=start_date,
+            end_date=end_date,
+            large_move_threshold=large_move_threshold
+        )
+        # Start the batch now so setup errors are reported before streaming
+        first_row = next(rows, None)
+        
+        def generate():
+            # Stream one JSON object per line as each symbol finishes
+            if first_row is not None:
+                yield json.dumps(first_row) + '\n'
+            for row in rows:
+                yield json.dumps(row) + '\n'
+            logger.info("Batch analysis completed")
         
-        # Convert trades to DataFrame
-        df = pd.DataFrame(trades)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        logger.error(f"Error in batch route: {str(e)}")
+        return jsonify({'error': f"An error occurred: {str(e)}"})
+
+def find_ledger(result_id):
+    """Return the trade ledger of a result, recomputing it if this worker does not hold it
+
+    Returns None when the result ID cannot be read or the prices have
+    changed since the analysis ran.
+    """
+    key, params = parse_result_id(result_id)
+    entry = RESULT_CACHE.get(key)
+    if entry is not None:
+        return entry['ledger']
+    if params is None:
+        return None
+
+    try:
+        strategy = strategy_from_form(params)
+    except (KeyError, ValueError):
+        return None
+    stock_data, sp500_data, error = strategy.get_historical_data()
+    if error or analysis_key(strategy, stock_data, sp500_data) != key:
+        return None
+    logger.info(f"Recomputing trades of result {key}")
+    strategy.run_vectorized(stock_data)
+    return strategy.get_trade_ledger()
+
+@app.route('/download_trades', methods=['GET', 'POST'])
+def download_trades():
+    try:
+        # Get the stored result to export
+        params = request.values if request.json is None else request.json
+        result_id = params.get('result_id')
+        export_format = params.get('format', 'csv')
+        ledger = find_ledger(result_id) if result_id else None
+        if ledger is None:
+            return jsonify({'error': 'Result not found, please run the analysis again'}), 404
         
-        # Create CSV in memory
-        csv_buffer = BytesIO()
-        df.to_csv(csv_buffer, index=False)
-        csv_buffer.seek(0)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if export_format == 'csv':
+            chunks = ledger.iter_csv()
+            mimetype = 'text/csv'
+        elif export_format == 'parquet':
+            chunks = ledger.iter_parquet()
+            # Fail here rather than mid-stream when pyarrow is missing
+            try:
+                first_chunk = next(chunks)
+            except ImportError as e:
+                return jsonify({'error': f'Parquet export is not available: {str(e)}'}), 501
+            chunks = itertools.chain([first_chunk], chunks)
+            mimetype = 'application/vnd.apache.parquet'
+        else:
+            return jsonify({'error': f"Unknown export format '{export_format}'"}), 400
         
         # Generate filename
-        filename = f'trading_trades_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        filename = f'trading_trades_{timestamp}.{export_format}'
         
-        return send_file(
-            csv_buffer,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+        # Stream the file straight from the stored ledger
+        return Response(
+            chunks,
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
         )
         
     except Exception as e:
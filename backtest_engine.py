@@ -0,0 +1,197 @@
+import numpy as np
+
+__all__ = ['streak_lengths', 'find_signals', 'fill_signals', 'equity_curve', 'run_backtest', 'resume_backtest']
+
+BUY = 1
+SELL = -1
+
+
+def streak_lengths(close, up_days=0, down_days=0):
+    """Return the up and down streak counters for every bar
+
+    Bar i counts as an up day when its close is strictly above the previous
+    close, otherwise as a down day. Bar 0 has no previous close, so its
+    counters are the ones carried in from earlier bars, zero by default.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    carried_up, carried_down = up_days, down_days
+    up_days = np.full(n, carried_up, dtype=np.int64)
+    down_days = np.full(n, carried_down, dtype=np.int64)
+    if n < 2:
+        return up_days, down_days
+
+    # Direction of every move and the start of every run of equal direction
+    is_up = np.diff(close) > 0
+    run_starts = np.flatnonzero(np.concatenate(([True], is_up[1:] != is_up[:-1])))
+    run_lengths = np.diff(np.append(run_starts, len(is_up)))
+
+    # Position inside the current run, counting from 1, with the first run
+    # continuing the carried streak when it goes the same way
+    positions = np.arange(len(is_up)) - np.repeat(run_starts, run_lengths) + 1
+    positions[:run_lengths[0]] += carried_up if is_up[0] else carried_down
+    up_days[1:] = np.where(is_up, positions, 0)
+    down_days[1:] = np.where(is_up, 0, positions)
+    return up_days, down_days
+
+
+def find_signals(close, consecutive_days, shares_small_move, shares_large_move, large_move_threshold=5,
+                 first_bar=1, up_days=0, down_days=0):
+    """Find candidate signal bars with their direction, move size and share count
+
+    Only bars that have a close ``consecutive_days`` bars ahead of the window
+    start are considered, matching the reference loop. Moves of at least
+    ``large_move_threshold`` percent trade ``shares_large_move`` shares.
+
+    To resume a run, ``first_bar`` is the first bar still to evaluate and
+    up_days/down_days are the counters at the bar before it.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n_bars = len(close) - consecutive_days
+    up_streak, down_streak = streak_lengths(close[first_bar - 1:], up_days, down_days)
+
+    bars = np.arange(first_bar, max(n_bars, first_bar))
+    sides = np.where(up_streak[bars - first_bar + 1] >= consecutive_days, SELL,
+                     np.where(down_streak[bars - first_bar + 1] >= consecutive_days, BUY, 0))
+    bars = bars[sides != 0]
+    sides = sides[sides != 0]
+
+    # Percentage move over the window starting consecutive_days - 1 bars back
+    start_prices = close[bars - consecutive_days + 1]
+    end_prices = close[bars + 1]
+    moves = ((end_prices - start_prices) / start_prices) * 100
+    shares = np.where(np.abs(moves) >= large_move_threshold, shares_large_move, shares_small_move)
+    return bars, sides, moves, shares
+
+
+def fill_signals(close, bars, sides, shares, cash, held=0):
+    """Apply the cash and holdings constraints to the candidate signals
+
+    Returns the indices of the signals that produced a fill, the filled share
+    counts and the cash and share balances right after each fill, all as
+    arrays trimmed to the number of fills.
+    """
+    prices = np.asarray(close, dtype=np.float64)[bars].tolist()
+    n_signals = len(prices)
+    filled = np.empty(n_signals, dtype=np.int64)
+    filled_shares = np.empty(n_signals, dtype=np.int64)
+    cash_after = np.empty(n_signals, dtype=np.float64)
+    held_after = np.empty(n_signals, dtype=np.int64)
+
+    n_fills = 0
+    for j, (side, wanted, price) in enumerate(zip(sides.tolist(), shares.tolist(), prices)):
+        if side == SELL:
+            if held <= 0:
+                continue
+            quantity = min(held, wanted)
+            cash += quantity * price
+            held -= quantity
+        else:
+            quantity = min(wanted, int(cash / price))
+            if quantity <= 0:
+                continue
+            cash -= quantity * price
+            held += quantity
+        filled[n_fills] = j
+        filled_shares[n_fills] = quantity
+        cash_after[n_fills] = cash
+        held_after[n_fills] = held
+        n_fills += 1
+    return filled[:n_fills], filled_shares[:n_fills], cash_after[:n_fills], held_after[:n_fills]
+
+
+def equity_curve(close, fill_bars, cash_after, held_after, initial_investment, initial_held=0):
+    """Mark the balances after each fill to market on every bar
+
+    Bars before the first fill hold initial_investment in cash and
+    initial_held shares.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    # Index of the most recent fill at or before each bar, -1 before the first one
+    last_fill = np.searchsorted(fill_bars, np.arange(len(close)), side='right') - 1
+    has_fill = last_fill >= 0
+    last_fill = np.maximum(last_fill, 0)
+
+    cash = np.full(len(close), initial_investment, dtype=np.float64)
+    held = np.full(len(close), initial_held, dtype=np.int64)
+    if len(fill_bars):
+        cash = np.where(has_fill, cash_after[last_fill], cash)
+        held = np.where(has_fill, held_after[last_fill], held)
+    return cash + (held * close)
+
+
+def run_backtest(close, consecutive_days, shares_small_move, shares_large_move, initial_investment,
+                 large_move_threshold=5, signals=None):
+    """Run the consecutive-move strategy over an array of closing prices
+
+    This is the single simulation core: one pass produces both the trade
+    ledger (fill bars, actions, share counts, prices and moves as arrays)
+    and the daily equity curve, plus the final cash, shares and portfolio
+    value. signals are the (bars, sides, moves, shares) of find_signals
+    when they have already been looked up, e.g. in a StreakIndex.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    if signals is None:
+        signals = find_signals(close, consecutive_days, shares_small_move, shares_large_move, large_move_threshold)
+    bars, sides, moves, shares = signals
+    filled, filled_shares, cash_after, held_after = fill_signals(
+        close, bars, sides, shares, initial_investment
+    )
+    fill_bars = bars[filled]
+    cash = cash_after[-1].item() if len(filled) else initial_investment
+    held = held_after[-1].item() if len(filled) else 0
+
+    # The last bar the strategy looks at is the one before the lookahead window
+    last_price = close[len(close) - consecutive_days - 1]
+    return {
+        'bars': fill_bars,
+        'sides': sides[filled],
+        'shares': filled_shares,
+        'prices': close[fill_bars],
+        'moves': moves[filled],
+        'equity': equity_curve(close, fill_bars, cash_after, held_after, initial_investment),
+        'cash': cash,
+        'held': held,
+        'final_value': cash + (held * last_price)
+    }
+
+
+def resume_backtest(close, first_bar, consecutive_days, shares_small_move, shares_large_move, cash, held,
+                    up_days=0, down_days=0, large_move_threshold=5):
+    """Continue a run from saved counters and balances over an array of closing prices
+
+    ``close`` starts early enough to cover the move window of
+    ``first_bar``, the first bar still to evaluate. up_days/down_days are
+    the streak counters at the bar before it, cash and held the balances
+    at that point. Every bar that now has its lookahead close is
+    evaluated. Returns the fills as arrays, with the balances right after
+    each one, plus the counters and balances at the last evaluated bar.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    last_bar = len(close) - consecutive_days - 1
+    bars, sides, moves, shares = find_signals(
+        close, consecutive_days, shares_small_move, shares_large_move, large_move_threshold,
+        first_bar, up_days, down_days
+    )
+    filled, filled_shares, cash_after, held_after = fill_signals(close, bars, sides, shares, cash, held)
+    if len(filled):
+        cash, held = cash_after[-1].item(), held_after[-1].item()
+
+    if last_bar >= first_bar:
+        up_streak, down_streak = streak_lengths(close[first_bar - 1:last_bar + 1], up_days, down_days)
+        up_days, down_days = up_streak[-1].item(), down_streak[-1].item()
+    fill_bars = bars[filled]
+    return {
+        'bars': fill_bars,
+        'sides': sides[filled],
+        'shares': filled_shares,
+        'prices': close[fill_bars],
+        'moves': moves[filled],
+        'cash_after': cash_after,
+        'held_after': held_after,
+        'cash': cash,
+        'held': held,
+        'up_days': up_days,
+        'down_days': down_days,
+        'last_bar': max(last_bar, first_bar - 1)
+    }
@@ -0,0 +1,99 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from backtest_engine import run_backtest
+from benchmark_cache import BENCHMARK_CACHE
+from process_pool import POOL_SIZE, submit
+from trading_strategy import TradingStrategy
+
+__all__ = ['MAX_BATCH_SYMBOLS', 'analyze_batch']
+
+# Upper bound on the number of symbols in one batch
+MAX_BATCH_SYMBOLS = 1000
+
+
+def _summarize(symbol, close, consecutive_days, shares_small_move, shares_large_move, initial_investment,
+               large_move_threshold, sp500_return):
+    """Process pool entry point: simulate one symbol and return its summary row"""
+    result = run_backtest(
+        close, consecutive_days, shares_small_move, shares_large_move, initial_investment, large_move_threshold
+    )
+    return {
+        'symbol': symbol,
+        'final_value': result['final_value'],
+        'total_return': ((result['final_value'] - initial_investment) / initial_investment) * 100,
+        'sp500_return': sp500_return,
+        'buy_and_hold_return': ((close[-1] - close[0]) / close[0]) * 100,
+        'number_of_trades': len(result['bars']),
+        'error': None
+    }
+
+
+def analyze_batch(symbols, initial_investment, shares_small_move, shares_large_move, consecutive_days,
+                  start_date=None, end_date=None, large_move_threshold=5, data_provider=None,
+                  fetch_workers=8, processes=None):
+    """Run the strategy over a list of symbols, yielding a summary row per symbol as it finishes
+
+    Prices are fetched concurrently by a pool of ``fetch_workers`` threads
+    and the benchmark is fetched once for the whole batch. Each series is
+    simulated in the shared process pool as soon as its fetch completes, or
+    in this process when ``processes`` is 1. A symbol that fails yields a
+    row with its error message instead of stopping the batch.
+    """
+    symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol.strip()))
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        raise ValueError(f'A batch can have at most {MAX_BATCH_SYMBOLS} symbols')
+
+    # The template strategy only provides the date range and data provider
+    strategy = TradingStrategy(
+        initial_investment=initial_investment,
+        shares_small_move=shares_small_move,
+        shares_large_move=shares_large_move,
+        consecutive_days=consecutive_days,
+        stock_symbol=None,
+        start_date=start_date,
+        end_date=end_date,
+        data_provider=data_provider,
+        large_move_threshold=large_move_threshold
+    )
+    provider = strategy.data_provider
+    start, end = strategy.get_date_range()
+
+    sp500_data = BENCHMARK_CACHE.get('^GSPC', start, end, provider.fetch)
+    if sp500_data is None or sp500_data.empty:
+        raise ValueError('Unable to fetch S&P 500 data')
+    sp500_return = ((sp500_data['Close'].iloc[-1] - sp500_data['Close'].iloc[0]) / sp500_data['Close'].iloc[0]) * 100
+
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, min(fetch_workers, len(symbols))))
+    in_pool = (processes or POOL_SIZE) > 1
+    try:
+        pending = {fetch_pool.submit(provider.fetch, symbol, start, end): ('fetch', symbol) for symbol in symbols}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, symbol = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield {'symbol': symbol, 'error': f'Error during {stage}: {str(e)}'}
+                    continue
+
+                if stage == 'simulate':
+                    yield result
+                elif result is None or len(result) <= consecutive_days:
+                    yield {'symbol': symbol, 'error': f'No data available for {symbol}'}
+                else:
+                    args = (
+                        symbol, result['Close'].to_numpy(dtype=np.float64), consecutive_days, shares_small_move,
+                        shares_large_move, initial_investment, large_move_threshold, float(sp500_return)
+                    )
+                    if in_pool:
+                        pending[submit(_summarize, *args)] = ('simulate', symbol)
+                    else:
+                        yield _summarize(*args)
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        # The pool is shared, so only this batch's queued simulations are dropped
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+__all__ = ['TTLCache', 'SingleFlight', 'BenchmarkCache', 'BENCHMARK_CACHE']
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ttl seconds after being stored"""
+
+    def __init__(self, maxsize=64, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) for a live entry, otherwise (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries when full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call:
+    """An in-flight call that other callers with the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the call already running for it
+
+        Every caller gets the leader's return value, or its exception
+        re-raised.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class BenchmarkCache:
+    """Process-wide cache of benchmark series shared by every request in a worker
+
+    Entries are keyed by ticker and calendar date range. Concurrent misses
+    for the same key cause a single upstream fetch. Failed fetches (None)
+    are not cached.
+    """
+
+    def __init__(self, maxsize=32, ttl=900):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.flight = SingleFlight()
+
+    def get(self, ticker, start_date, end_date, fetch):
+        """Return the cached series, calling fetch(ticker, start_date, end_date) on a miss
+
+        The returned DataFrame is shared between callers and must not be
+        modified.
+        """
+        key = (ticker, pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date())
+        hit, df = self.cache.get(key)
+        if hit:
+            return df
+
+        def load():
+            # Another leader may have filled the entry while we were queued
+            hit, df = self.cache.get(key)
+            if hit:
+                return df
+            df = fetch(ticker, start_date, end_date)
+            if df is not None and not df.empty:
+                self.cache.set(key, df)
+            return df
+
+        return self.flight.do(key, load)
+
+
+BENCHMARK_CACHE = BenchmarkCache()
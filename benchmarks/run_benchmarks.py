@@ -0,0 +1,255 @@
+"""Offline, reproducible benchmarks of the analysis pipeline
+
+Prices come from the seeded synthetic generator in price_data.py, so runs
+need no network and see the same bars every time. Every measurement is
+written as one JSON object per line, to stdout or to --output, starting
+with a record describing the environment.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000 --output bench.jsonl
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Add the parent directory to the Python path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every provider the app builds serves synthetic prices
+os.environ['PRICE_DATA_SOURCE'] = 'synthetic'
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from price_data import synthetic_prices
+from trading_strategy import TradingStrategy
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Parameters shared by every benchmarked analysis
+STRATEGY_PARAMS = {
+    'initial_investment': 100000.0,
+    'shares_small_move': 10,
+    'shares_large_move': 20,
+    'consecutive_days': 3,
+    'stock_symbol': 'SYNTH'
+}
+
+
+def make_frames(n_bars, seed):
+    """Return synthetic stock and S&P 500 frames of n_bars bars on the same index
+
+    Daily bars cannot reach a million rows within the range of pandas
+    timestamps, so sizes above 10,000 use one bar per minute instead. The
+    strategy only looks at the order of the bars.
+    """
+    freq = 'B' if n_bars <= 10000 else 'min'
+    stock = synthetic_prices(n_bars, seed=seed, freq=freq)
+    sp500 = synthetic_prices(n_bars, seed=seed + 1, freq=freq, mu=0.08, sigma=0.15, initial_price=3000.0)
+    return stock, sp500
+
+
+def measure(fn, repeat, min_time):
+    """Call fn until it has run repeat times or for min_time seconds, at least once
+
+    Returns the wall time of each call.
+    """
+    times = []
+    started = time.perf_counter()
+    while not times or (len(times) < repeat and time.perf_counter() - started < min_time):
+        begin = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - begin)
+    return times
+
+
+def record(name, n_bars, times, **extra):
+    return {
+        'benchmark': name,
+        'bars': n_bars,
+        'runs': len(times),
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        **extra
+    }
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'benchmark': 'environment',
+        'time': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'seed': args.seed,
+        'sizes': args.sizes
+    }
+
+
+def strategy_benchmarks(n_bars, args):
+    """Time the analysis and its stages over n_bars synthetic bars"""
+    stock, sp500 = make_frames(n_bars, args.seed)
+
+    def strategy(**kwargs):
+        return TradingStrategy(**STRATEGY_PARAMS, **kwargs)
+
+    for plot_mode in ['lite', 'inline']:
+        if plot_mode == 'inline' and n_bars > args.max_inline_bars:
+            continue
+        times = measure(lambda: strategy(plot_mode=plot_mode).analyze(stock, sp500), args.repeat, args.min_time)
+        yield record('analyze', n_bars, times, plot_mode=plot_mode, engine='vectorized')
+
+    if n_bars <= args.max_reference_bars:
+        times = measure(lambda: strategy(engine='reference', plot_mode='lite').analyze(stock, sp500), args.repeat, args.min_time)
+        yield record('analyze', n_bars, times, plot_mode='lite', engine='reference')
+
+    # Each call gets a fresh strategy, so the simulation is included
+    times = measure(lambda: strategy().calculate_portfolio_value_over_time(stock), args.repeat, args.min_time)
+    yield record('calculate_portfolio_value_over_time', n_bars, times)
+
+    plotted = strategy()
+    portfolio_values = plotted.calculate_portfolio_value_over_time(stock)
+    if n_bars <= args.max_inline_bars:
+        times = measure(lambda: plotted.create_performance_plot(stock, portfolio_values, sp500), args.repeat, args.min_time)
+        yield record('create_performance_plot', n_bars, times)
+    times = measure(lambda: plotted.create_plot_payload(stock, portfolio_values, sp500), args.repeat, args.min_time)
+    yield record('create_plot_payload', n_bars, times)
+
+
+# Modules timed on a cold import, with the directory they are imported from
+IMPORT_TARGETS = [
+    ('strategy_core', ROOT),
+    ('analyze', os.path.join(ROOT, 'api')),
+    ('trading_strategy', ROOT),
+    ('app', ROOT)
+]
+
+
+def import_benchmarks(args):
+    """Time importing each entry point in a fresh interpreter, as on a cold start"""
+    for module, path in IMPORT_TARGETS:
+        code = (
+            f'import sys, time; sys.path.insert(0, {path!r}); started = time.perf_counter(); '
+            f'import {module}; print(time.perf_counter() - started, len(sys.modules))'
+        )
+
+        runs = []
+
+        def run():
+            output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+            runs.append(output.stdout.split())
+
+        measure(run, args.repeat, args.min_time)
+        times = [float(seconds) for seconds, _ in runs]
+        yield record('import', None, times, module=module, modules_loaded=int(runs[-1][1]))
+
+
+def flask_benchmarks(args):
+    """Time POST /analyze end to end through the Flask test client
+
+    The synthetic provider serves daily bars, so the sizes are capped by the
+    number of business days between 1970 and the end date.
+    """
+    from app import app
+    from benchmark_cache import BENCHMARK_CACHE
+    from result_cache import RESULT_CACHE
+    from streak_index import STREAK_INDEXES
+
+    client = app.test_client()
+    end_date = pd.Timestamp('2024-01-01')
+    available = len(pd.bdate_range('1970-01-01', end_date - pd.Timedelta(days=1)))
+    for n_bars in args.sizes:
+        if n_bars > available:
+            continue
+        form = {
+            **{name: str(value) for name, value in STRATEGY_PARAMS.items()},
+            'start_date': (end_date - pd.offsets.BDay(n_bars)).strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'plot_mode': 'lite'
+        }
+
+        def post(headers=None):
+            response = client.post('/analyze', data=form, headers={'Accept': 'application/json', **(headers or {})})
+            if response.status_code not in (200, 304) or (response.status_code == 200 and 'error' in response.get_json()):
+                raise RuntimeError(f'/analyze failed: {response.get_data(as_text=True)[:200]}')
+            return response
+
+        def cold():
+            RESULT_CACHE.clear()
+            BENCHMARK_CACHE.cache.clear()
+            STREAK_INDEXES.clear()
+            post()
+
+        times = measure(cold, args.repeat, args.min_time)
+        yield record('flask_analyze', n_bars, times, cache='cold')
+
+        etag = post().headers['ETag'].strip('"')
+        times = measure(post, args.repeat, args.min_time)
+        yield record('flask_analyze', n_bars, times, cache='warm')
+        times = measure(lambda: post({'If-None-Match': f'"{etag}"'}), args.repeat, args.min_time)
+        yield record('flask_analyze', n_bars, times, cache='not_modified')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated bar counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='maximum runs per measurement')
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='stop repeating a measurement after this many seconds')
+    parser.add_argument('--max-inline-bars', type=int, default=100000,
+                        help='largest size to render as a full inline plot')
+    parser.add_argument('--max-reference-bars', type=int, default=100000,
+                        help='largest size to run the bar-by-bar reference engine on')
+    parser.add_argument('--no-flask', action='store_true', help='skip the Flask /analyze benchmarks')
+    parser.add_argument('--no-imports', action='store_true', help='skip the cold import benchmarks')
+    parser.add_argument('--output', help='append JSON lines to this file instead of stdout')
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        def emit(row):
+            out.write(json.dumps(row) + '\n')
+            out.flush()
+
+        # Keep the strategy's progress messages out of the JSON lines
+        stack = contextlib.ExitStack()
+        stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        emit(environment(args))
+        if not args.no_imports:
+            for row in import_benchmarks(args):
+                emit(row)
+        for n_bars in args.sizes:
+            for row in strategy_benchmarks(n_bars, args):
+                emit(row)
+        if not args.no_flask:
+            for row in flask_benchmarks(args):
+                emit(row)
+        stack.close()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+__all__ = [
+    'Counter',
+    'Histogram',
+    'Registry',
+    'REGISTRY',
+    'STAGE_SECONDS',
+    'REQUEST_SECONDS',
+    'UPSTREAM_REQUESTS',
+    'UPSTREAM_RETRIES',
+    'FETCH_FAILURES',
+    'enabled',
+    'set_enabled',
+    'span',
+    'timed',
+    'begin_request',
+    'end_request',
+    'server_timing'
+]
+
+# Set TIMING_ENABLED=0 to turn spans and metrics into no-ops
+_enabled = os.environ.get('TIMING_ENABLED', '1') != '0'
+
+# Spans recorded during the current request, or None outside of one
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+_NULL_SPAN = nullcontext()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for label_values, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Histogram of observed values with fixed cumulative buckets, split by label values"""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [per-bucket counts with a final +Inf bucket, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not _enabled:
+            return
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip([*map(repr, self.buckets), '+Inf'], counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format
+
+    Metrics live in the memory of each process, so with several gunicorn
+    worker processes every scrape only sees the worker that answered it.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.expose()) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'kailash_stage_duration_seconds', 'Time spent in each stage of handling a request', ['stage']
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'kailash_request_duration_seconds', 'Time to produce a response, by endpoint and status', ['endpoint', 'status']
+))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    'kailash_upstream_requests_total', 'Requests made to the upstream price source'
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    'kailash_upstream_retries_total', 'Upstream price requests that were retries of a failed attempt'
+))
+FETCH_FAILURES = REGISTRY.register(Counter(
+    'kailash_fetch_failures_total', 'Price fetches that gave up without data'
+))
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(flag):
+    """Turn timing spans and metrics on or off for the whole process"""
+    global _enabled
+    _enabled = bool(flag)
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(duration, self.name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.name, duration))
+        return False
+
+
+def span(name):
+    """Return a context manager that times a stage
+
+    The duration goes to the stage histogram and, inside a request, to the
+    request's Server-Timing header. When timing is disabled this returns a
+    shared no-op context manager.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator that runs the whole function inside span(name)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def begin_request():
+    """Start collecting the spans of the request handled by this thread"""
+    if _enabled:
+        _request_spans.set([])
+
+
+def end_request():
+    """Stop collecting and return the spans recorded since begin_request()"""
+    spans = _request_spans.get()
+    _request_spans.set(None)
+    return spans or []
+
+
+def server_timing(spans, total=None):
+    """Format spans as a Server-Timing header value, durations in milliseconds"""
+    entries = [f'{name};dur={duration * 1000:.1f}' for name, duration in spans]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
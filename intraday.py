@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from price_data import ColumnarPriceStore
+from strategy_core import percent_change
+
+__all__ = ['DEFAULT_CHUNK_BARS', 'TRADE_COLUMNS', 'import_csv', 'run_intraday']
+
+# Bars read from disk and simulated at a time, which bounds peak memory
+DEFAULT_CHUNK_BARS = 1 << 20
+
+# Columns of the trades written by run_intraday, indexed by the fill time
+TRADE_COLUMNS = ['action', 'shares', 'price', 'price_movement']
+
+
+def import_csv(store, symbol, csv_path, chunk_bars=DEFAULT_CHUNK_BARS):
+    """Copy bars from a CSV file into a ColumnarPriceStore without reading the file whole
+
+    The first column holds the bar times, which are read as UTC unless
+    they carry an offset, and the numeric columns of the first rows are
+    kept. Rows must be in time order. Returns the number of bars stored.
+    """
+    chunks = pd.read_csv(csv_path, index_col=0, chunksize=chunk_bars)
+    writer = None
+    try:
+        for chunk in chunks:
+            index = pd.to_datetime(chunk.index, utc=True)
+            if writer is None:
+                numeric = chunk.select_dtypes(include=[np.number]).columns
+                writer = store.writer(symbol, numeric, tz='UTC')
+            writer.append(index.tz_localize(None).values, {name: chunk[name].to_numpy() for name in numeric})
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        raise
+    if writer is None:
+        return 0
+    writer.close()
+    return writer.rows
+
+
+def _read_window(values, start, stop):
+    """Copy rows start to stop of a memory-mapped .npy column through a map of just those rows
+
+    Pages touched through a map stay resident until it is closed, so
+    slicing the map of the whole file would make memory grow with every
+    chunk read.
+    """
+    stop = min(stop, len(values))
+    window = np.memmap(values.filename, dtype=values.dtype, mode='r',
+                       offset=values.offset + start * values.itemsize, shape=(stop - start,))
+    return np.array(window)
+
+
+def run_intraday(strategy, store, symbol, output_dir, chunk_bars=DEFAULT_CHUNK_BARS):
+    """Run a TradingStrategy over a symbol's stored bars, chunk by chunk
+
+    The bars are read through memory maps chunk_bars rows at a time and fed to
+    strategy.advance(), which carries the streak counters and balances
+    from one chunk to the next. The equity of every evaluated bar and the
+    trades are written to output_dir as the 'equity' and 'trades' entries
+    of a ColumnarPriceStore, so nothing grows with the length of the
+    history. The result matches analyze() over the same bars.
+    """
+    stored = store.open(symbol)
+    if stored is None:
+        return {'error': f'No bars stored for {symbol}'}
+    index, columns, meta = stored
+    if 'Close' not in columns:
+        return {'error': f'No closing prices stored for {symbol}'}
+    close = columns['Close']
+    if len(close) <= strategy.consecutive_days:
+        return {'error': f'Not enough data for {strategy.consecutive_days} consecutive days'}
+
+    output = ColumnarPriceStore(output_dir)
+    number_of_trades = 0
+    with output.writer('equity', ['equity'], tz=meta['tz']) as equity, \
+            output.writer('trades', TRADE_COLUMNS, tz=meta['tz']) as trades:
+        for start in range(0, len(close), chunk_bars):
+            stop = start + chunk_bars
+            step = strategy.advance(_read_window(index, start, stop).view('datetime64[ns]'),
+                                    _read_window(close, start, stop))
+            equity.append(step['equity_dates'], {'equity': step['equity']})
+            trades.append(step['dates'], {
+                'action': step['sides'],
+                'shares': step['shares'],
+                'price': step['prices'],
+                'price_movement': step['moves']
+            })
+            number_of_trades += len(step['dates'])
+
+    final_value = strategy.state.portfolio_value
+    total_return = percent_change(strategy.initial_investment, final_value)
+    return {
+        'initial_investment': f'${strategy.initial_investment:,.2f}',
+        'final_value': f'${final_value:,.2f}',
+        'total_return': f'{total_return:.2f}%',
+        'number_of_trades': number_of_trades,
+        'bars': len(close),
+        'equity_rows': equity.rows
+    }
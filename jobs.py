@@ -0,0 +1,252 @@
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+__all__ = ['JobQueueFull', 'Job', 'JobManager']
+
+# How often a job run by another process is re-read while waiting for its events
+POLL_INTERVAL = 0.25
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    """A unit of work with its status, stage-by-stage progress and outcome
+
+    A job given a state_dir writes its state there on every change, so
+    other processes on the host can follow it through Job.load().
+    """
+
+    def __init__(self, state_dir=None):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.events = [{'stage': 'queued', 'time': time.time()}]
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.owner = os.getpid()
+        self._path = None if state_dir is None else os.path.join(state_dir, f'{self.id}.json')
+        self._loaded = False
+        self._stamp = None
+        self._changed = threading.Condition()
+
+    @classmethod
+    def load(cls, path):
+        """Return a read-only copy of the job another process writes to path, or None if there is none"""
+        job = cls()
+        job._path = path
+        job._loaded = True
+        return job if job._reload() else None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def report(self, stage):
+        """Record that the job has entered a stage and wake anyone waiting on it"""
+        with self._changed:
+            self.stage = stage
+            self.events.append({'stage': stage, 'time': time.time()})
+            self._save()
+            self._changed.notify_all()
+
+    def _finish(self, status, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.stage = status
+            self.events.append({'stage': status, 'time': self.finished_at, 'error': error})
+            self._save()
+            self._changed.notify_all()
+
+    def _save(self):
+        """Write the job's state for other processes, if it has a state_dir"""
+        if self._path is None or self._loaded:
+            return
+        state = dict(self.to_dict(), events=self.events, result=self.result, owner=self.owner)
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._path))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self._path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing state of job {self.id}: {str(e)}")
+
+    def _reload(self):
+        """Re-read a loaded job's state if it has changed, returning False when it cannot be read"""
+        try:
+            stat = os.stat(self._path)
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stamp == self._stamp:
+                return True
+            with open(self._path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._stamp = stamp
+        self.id = state['job_id']
+        self.status = state['status']
+        self.stage = state['stage']
+        self.events = state['events']
+        self.result = state['result']
+        self.error = state['error']
+        self.created_at = state['created_at']
+        self.finished_at = state['finished_at']
+        self.owner = state['owner']
+
+        if not self.finished and not _alive(self.owner):
+            # The worker running the job exited before finishing it
+            self.status = self.stage = 'failed'
+            self.error = 'The worker running this job exited'
+            self.finished_at = time.time()
+            self.events = self.events + [{'stage': 'failed', 'time': self.finished_at, 'error': self.error}]
+        return True
+
+    def wait_events(self, start, timeout=None):
+        """Wait until there are events past index start, then return them
+
+        Returns the new events (possibly none after a timeout) and whether
+        the job has finished. A loaded job is re-read every POLL_INTERVAL
+        seconds while waiting.
+        """
+        if self._loaded:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while len(self.events) <= start and not self.finished:
+                wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+                self._reload()
+            return self.events[start:], self.finished
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > start or self.finished, timeout)
+            return self.events[start:], self.finished
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    """Run jobs on a bounded pool of worker threads fed by a bounded local queue
+
+    Jobs run in the process that accepted them. With a state_dir, every
+    job's state is also written there, so any process on the host that
+    shares the directory can answer status, result and event requests for
+    it, e.g. every gunicorn worker. Finished jobs are kept until more than
+    max_finished have accumulated, and state files are removed after
+    max_age seconds even if the process that wrote them has gone.
+    """
+
+    def __init__(self, workers=2, max_queued=64, max_finished=256, state_dir=None, max_age=24 * 3600):
+        self.workers = workers
+        self.max_finished = max_finished
+        self.state_dir = state_dir
+        self.max_age = max_age
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, fn):
+        """Queue fn(report) to run on a worker and return its Job
+
+        fn receives the job's report callback and its return value becomes
+        the job result. Raises JobQueueFull when the queue is at capacity.
+        """
+        job = Job(self.state_dir)
+        with self._lock:
+            self._start_workers()
+            try:
+                self._queue.put_nowait((job, fn))
+            except queue.Full:
+                raise JobQueueFull(f'The job queue is full ({self._queue.maxsize} jobs waiting)')
+            self._jobs[job.id] = job
+            # A worker may already be running the job and saving its stages
+            with job._changed:
+                job._save()
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None
+
+        Jobs accepted by other processes are read from the state_dir.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.state_dir is None or not re.fullmatch(r'[0-9a-f]{32}', job_id):
+            return job
+        return Job.load(os.path.join(self.state_dir, f'{job_id}.json'))
+
+    def _start_workers(self):
+        # Started on first use so importing the app does not spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            job = self._jobs.pop(job_id)
+            if job._path is not None:
+                try:
+                    os.unlink(job._path)
+                except OSError:
+                    pass
+
+        if self.state_dir is not None:
+            # Files of jobs whose process exited without pruning them
+            expired = time.time() - self.max_age
+            try:
+                with os.scandir(self.state_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.json') and entry.stat().st_mtime < expired:
+                            os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def _work(self):
+        while True:
+            job, fn = self._queue.get()
+            job.status = 'running'
+            job.report('running')
+            try:
+                job._finish('done', result=fn(job.report))
+            except Exception as e:
+                print(f"Error in job {job.id}: {str(e)}")
+                job._finish('failed', error=str(e))
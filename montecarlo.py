@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+
+from backtest_engine import BUY, SELL
+from plot_payload import figure_html
+from process_pool import POOL_SIZE, map_tasks
+
+__all__ = [
+    'MAX_PATHS',
+    'PERCENTILES',
+    'bootstrap_indices',
+    'regime_segments',
+    'simulate_paths',
+    'run_monte_carlo',
+    'summarize_monte_carlo',
+    'create_monte_carlo_plot'
+]
+
+# Upper bound on the number of paths accepted by run_monte_carlo
+MAX_PATHS = 100000
+
+# Number of paths generated and simulated together in one task
+CHUNK_SIZE = 2048
+
+# Percentiles reported for the distributions and drawn as bands on the plot
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def regime_segments(log_returns, window=20):
+    """Split a return series into contiguous high and low volatility regimes
+
+    A bar is in the high volatility regime when the standard deviation of
+    the window returns ending at it is above the median. Returns the start
+    and end (exclusive) of every segment.
+    """
+    log_returns = np.asarray(log_returns, dtype=np.float64)
+    window = max(1, min(window, len(log_returns)))
+    # Rolling standard deviation from running sums, the first bars use what is available
+    sums = np.cumsum(np.concatenate(([0.0], log_returns)))
+    squares = np.cumsum(np.concatenate(([0.0], log_returns ** 2)))
+    ends = np.arange(1, len(log_returns) + 1)
+    starts = np.maximum(ends - window, 0)
+    counts = ends - starts
+    means = (sums[ends] - sums[starts]) / counts
+    variances = np.maximum((squares[ends] - squares[starts]) / counts - means ** 2, 0)
+    high = variances > np.median(variances)
+
+    boundaries = np.flatnonzero(high[1:] != high[:-1]) + 1
+    segment_starts = np.concatenate(([0], boundaries))
+    segment_ends = np.append(boundaries, len(log_returns))
+    return segment_starts, segment_ends
+
+
+def bootstrap_indices(n_returns, n_paths, n_steps, block_size, rng, segments=None):
+    """Draw the source index of every return of every path, as a (n_paths, n_steps) array
+
+    Without segments this is a circular block bootstrap: each path strings
+    together blocks of block_size consecutive returns starting at random
+    bars. With segments (from regime_segments), every path plays the
+    regimes in its own random order, each lasting as long as it did
+    historically and filled with blocks drawn from that regime only.
+    """
+    block_size = max(1, min(block_size, n_returns))
+    steps = np.arange(n_steps)
+    if segments is None:
+        n_blocks = -(-n_steps // block_size)
+        block_starts = rng.integers(0, n_returns, size=(n_paths, n_blocks))
+        return (block_starts[:, steps // block_size] + steps % block_size) % n_returns
+
+    segment_starts, segment_ends = segments
+    lengths = segment_ends - segment_starts
+    # Regime order of every path, repeated when the path is longer than the history
+    n_cycles = -(-n_steps // n_returns)
+    order = np.concatenate([
+        np.argsort(rng.random((n_paths, len(lengths))), axis=1) for _ in range(n_cycles)
+    ], axis=1)
+    # Step at which each regime of each path begins, and the regime active at every
+    # step, counting the regime starts up to it
+    path_starts = np.cumsum(lengths[order], axis=1) - lengths[order]
+    begins = path_starts < n_steps
+    marks = np.zeros((n_paths, n_steps), dtype=np.int32)
+    marks[np.nonzero(begins)[0], path_starts[begins]] = 1
+    slot = np.cumsum(marks, axis=1) - 1
+    active = np.take_along_axis(order, slot, axis=1)
+    position = steps - np.take_along_axis(path_starts, slot, axis=1)
+
+    # Blocks restart at every regime change and wrap around inside the regime
+    draws = rng.random((n_paths, -(-n_steps // block_size) + order.shape[1]))
+    block_id = np.cumsum(position % block_size == 0, axis=1) - 1
+    offset = (np.take_along_axis(draws, block_id, axis=1) * lengths[active]).astype(np.int64)
+    return segment_starts[active] + (offset + position % block_size) % lengths[active]
+
+
+def simulate_paths(close, consecutive_days, shares_small_move, shares_large_move, initial_investment,
+                   large_move_threshold=5):
+    """Run the strategy on every row of a 2-D array of closing prices at once
+
+    Follows run_backtest row by row: the streaks, signals and moves are
+    computed for all paths as arrays, and the fills step through the bars
+    with every path updated together. Returns the final values, maximum
+    drawdowns in percent and trade counts per path, and the equity of every
+    evaluated bar as a (paths, bars) array.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n_paths, n_bars = close.shape
+    last_bar = n_bars - consecutive_days
+
+    # Streak length at every bar, a close equal to the previous one counts as down
+    is_up = np.diff(close, axis=1) > 0
+    steps = np.arange(1, n_bars)
+    run_start = np.concatenate([np.ones((n_paths, 1), dtype=bool), is_up[:, 1:] != is_up[:, :-1]], axis=1)
+    streak = steps - np.maximum.accumulate(np.where(run_start, steps, 0), axis=1) + 1
+    sides = np.zeros((n_paths, n_bars), dtype=np.int8)
+    sides[:, 1:] = np.where(streak >= consecutive_days, np.where(is_up, SELL, BUY), 0)
+
+    # Move and share count of every bar that can trade, time-major so each bar is contiguous
+    evaluated = np.arange(1, max(last_bar, 1))
+    start_prices = close[:, evaluated - consecutive_days + 1]
+    moves = ((close[:, evaluated + 1] - start_prices) / start_prices) * 100
+    wanted = np.where(np.abs(moves) >= large_move_threshold, shares_large_move, shares_small_move).T.copy()
+    prices = close[:, evaluated].T.copy()
+    sells_at = (sides[:, evaluated] == SELL).T.copy()
+    buys_at = (sides[:, evaluated] == BUY).T.copy()
+
+    cash = np.full(n_paths, initial_investment, dtype=np.float64)
+    held = np.zeros(n_paths, dtype=np.int64)
+    trades = np.zeros(n_paths, dtype=np.int64)
+    equity = np.empty((max(last_bar, 1), n_paths), dtype=np.float64)
+    equity[0] = initial_investment
+    for row, bar in enumerate(evaluated):
+        price = prices[row]
+        sells = sells_at[row] & (held > 0)
+        bought = np.minimum(wanted[row], (cash / price).astype(np.int64))
+        buys = buys_at[row] & (bought > 0)
+        # Signed change in shares held, negative for a sale
+        change = np.where(sells, -np.minimum(held, wanted[row]), np.where(buys, bought, 0))
+        cash = cash - (change * price)
+        held = held + change
+        trades += sells | buys
+        equity[bar] = cash + (held * price)
+    equity = equity.T
+
+    final_values = cash + (held * close[:, last_bar - 1])
+    peaks = np.maximum.accumulate(equity, axis=1)
+    max_drawdowns = ((peaks - equity) / peaks).max(axis=1) * 100
+    return final_values, max_drawdowns, trades, equity
+
+
+def _run_chunk(args):
+    """Process pool entry point: generate and simulate one chunk of paths"""
+    (log_returns, start_price, n_paths, n_bars, block_size, segments, seed, params, band_bars) = args
+    rng = np.random.default_rng(seed)
+    indices = bootstrap_indices(len(log_returns), n_paths, n_bars - 1, block_size, rng, segments)
+    close = np.empty((n_paths, n_bars), dtype=np.float64)
+    close[:, 0] = start_price
+    close[:, 1:] = start_price * np.exp(np.cumsum(log_returns[indices], axis=1))
+    final_values, max_drawdowns, trades, equity = simulate_paths(close, **params)
+    return final_values, max_drawdowns, trades, equity[:, band_bars].astype(np.float32)
+
+
+def run_monte_carlo(close, initial_investment, shares_small_move, shares_large_move, consecutive_days,
+                    large_move_threshold=5, n_paths=1000, n_bars=None, block_size=20, shuffle_regimes=False,
+                    regime_window=20, seed=None, processes=None, band_points=250):
+    """Simulate the strategy on resampled price paths built from a series' daily returns
+
+    Paths start at the first close and are n_bars long, the length of the
+    history by default. Their log returns are drawn with a block bootstrap,
+    and with shuffle_regimes the volatility regimes of the history are also
+    played in a random order on each path (see bootstrap_indices). Paths
+    are generated and simulated in chunks of CHUNK_SIZE spread over the
+    shared process pool, or in this process when ``processes`` is 1, and
+    the same seed gives the same paths.
+
+    Returns (paths, bands): a DataFrame with the final value, total return,
+    maximum drawdown and trade count of every path, and a DataFrame of the
+    PERCENTILES of the return across paths at up to band_points bars.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n_bars = int(n_bars or len(close))
+    if len(close) < 3:
+        raise ValueError('At least 3 closing prices are needed to resample returns')
+    if n_bars <= consecutive_days + 1:
+        raise ValueError(f'Paths must be longer than {consecutive_days + 1} bars')
+    if not 0 < n_paths <= MAX_PATHS:
+        raise ValueError(f'The number of paths must be between 1 and {MAX_PATHS}')
+
+    log_returns = np.diff(np.log(close))
+    segments = regime_segments(log_returns, regime_window) if shuffle_regimes else None
+    params = {
+        'consecutive_days': consecutive_days,
+        'shares_small_move': shares_small_move,
+        'shares_large_move': shares_large_move,
+        'initial_investment': initial_investment,
+        'large_move_threshold': large_move_threshold
+    }
+    # Bars of the equity curve kept for the percentile bands
+    band_bars = np.unique(np.linspace(0, n_bars - consecutive_days - 1, band_points).astype(np.int64))
+
+    chunk_sizes = [min(CHUNK_SIZE, n_paths - start) for start in range(0, n_paths, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    tasks = [
+        (log_returns, close[0], size, n_bars, block_size, segments, chunk_seed, params, band_bars)
+        for size, chunk_seed in zip(chunk_sizes, seeds)
+    ]
+    if (processes or POOL_SIZE) > 1 and len(tasks) > 1:
+        chunks = map_tasks(_run_chunk, tasks)
+    else:
+        chunks = [_run_chunk(task) for task in tasks]
+
+    final_values, max_drawdowns, trades, equity = (np.concatenate(parts) for parts in zip(*chunks))
+    paths = pd.DataFrame({
+        'final_value': final_values,
+        'total_return': ((final_values - initial_investment) / initial_investment) * 100,
+        'max_drawdown': max_drawdowns,
+        'number_of_trades': trades
+    })
+    returns = ((equity - initial_investment) / initial_investment) * 100
+    bands = pd.DataFrame(
+        np.percentile(returns, PERCENTILES, axis=0).T,
+        index=pd.Index(band_bars, name='bar'),
+        columns=[f'p{percentile}' for percentile in PERCENTILES]
+    )
+    return paths, bands
+
+
+def summarize_monte_carlo(paths):
+    """Return the mean and PERCENTILES of every per-path measure as plain numbers"""
+    return {
+        column: {
+            'mean': float(paths[column].mean()),
+            **{f'p{percentile}': float(value)
+               for percentile, value in zip(PERCENTILES, np.percentile(paths[column], PERCENTILES))}
+        }
+        for column in paths.columns
+    }
+
+
+def create_monte_carlo_plot(bands, historical=None):
+    """Create a plot of the percentile bands of the return across paths
+
+    historical, if given, is the strategy's return on the real history as
+    a Series indexed by bar and is drawn on top of the bands.
+    """
+    import plotly.graph_objects as go
+
+    try:
+        fig = go.Figure()
+        x = bands.index
+        # Shade between symmetric percentiles, outermost first
+        for low, high, opacity in [('p5', 'p95', 0.15), ('p25', 'p75', 0.3)]:
+            fig.add_trace(go.Scatter(x=x, y=bands[high], line=dict(width=0), showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(
+                x=x, y=bands[low], line=dict(width=0), fill='tonexty',
+                fillcolor=f'rgba(0, 128, 0, {opacity})', name=f'{low[1:]}-{high[1:]}th percentile'
+            ))
+        fig.add_trace(go.Scatter(x=x, y=bands['p50'], name='Median', line=dict(color='green')))
+        if historical is not None:
+            fig.add_trace(go.Scatter(x=historical.index, y=historical, name='Historical',
+                                     line=dict(color='blue', dash='dot')))
+
+        fig.update_layout(
+            title='Strategy Return Across Resampled Paths',
+            xaxis_title='Trading days',
+            yaxis_title='Return (%)',
+            hovermode='x unified',
+            showlegend=True
+        )
+        return figure_html(fig)
+    except Exception as e:
+        print(f"Error creating Monte Carlo plot: {str(e)}")
+        return "<p>Error creating Monte Carlo plot</p>"
@@ -0,0 +1,124 @@
+import base64
+import functools
+import importlib.util
+import os
+import re
+
+import numpy as np
+
+__all__ = ['PLOTLY_JS_PATH', 'plotly_js_version', 'figure_html', 'lttb_indices', 'encode_floats', 'encode_dates',
+           'layout_json', 'build_plot_payload']
+
+# plotly.js as bundled with the plotly package, served to the browser as a static asset.
+# The package is located without importing it, which takes a good part of a second.
+PLOTLY_JS_PATH = os.path.join(os.path.dirname(importlib.util.find_spec('plotly').origin), 'package_data', 'plotly.min.js')
+
+
+@functools.lru_cache(maxsize=None)
+def plotly_js_version():
+    """Version of the bundled plotly.js, read from the banner at the top of the file"""
+    with open(PLOTLY_JS_PATH, 'rb') as f:
+        match = re.search(rb'plotly\.js v(\S+)', f.read(256))
+    if match:
+        return match.group(1).decode()
+    from plotly.offline import get_plotlyjs_version
+    return get_plotlyjs_version()
+
+
+def figure_html(fig):
+    """Render a figure as an HTML fragment for pages that already load plotly.js
+
+    The index page loads PLOTLY_JS_PATH once from /plotly.min.js, so the
+    fragment leaves out the 3.6 MB bundle plotly would otherwise inline.
+    """
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def lttb_indices(x, y, n_out):
+    """Pick n_out points of a series with the largest-triangle-three-buckets algorithm
+
+    The first and last points are always kept. The points in between are
+    split into n_out - 2 buckets, and from each bucket the point forming
+    the largest triangle with the previously kept point and the average of
+    the next bucket is kept, which preserves the visual shape.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket, or the last point for the final bucket
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def encode_floats(values):
+    """Encode values as base64 little-endian float32"""
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def encode_dates(index):
+    """Encode a DatetimeIndex as a start day and day deltas since the Unix epoch
+
+    The first delta is zero, so the days are the running sum of the deltas
+    added to start.
+    """
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    days = index.normalize().asi8 // (86400 * 10**9)
+    if not len(days):
+        return {'start': 0, 'deltas': []}
+    return {'start': int(days[0]), 'deltas': np.diff(days, prepend=days[0]).tolist()}
+
+
+def layout_json(**layout):
+    """Turn plotly's magic-underscore layout keywords into the nested layout plotly.js takes
+
+    xaxis_title='Date' becomes {'xaxis': {'title': {'text': 'Date'}}}, as
+    plotly.graph_objects would build it, without importing plotly.
+    """
+    nested = {}
+    for key, value in layout.items():
+        *parents, name = key.split('_')
+        node = nested
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = {'text': value} if name == 'title' and isinstance(value, str) else value
+    return nested
+
+
+def build_plot_payload(traces, layout, max_points=1500):
+    """Build a compact JSON plot description for the page to render with plotly.js
+
+    Each trace is (name, series, line style). Series longer than
+    max_points are downsampled with LTTB before being encoded.
+    """
+    payload = {'traces': [], 'layout': layout}
+    for name, series, line in traces:
+        series = series.dropna()
+        x = series.index.asi8.astype(np.float64)
+        kept = lttb_indices(x, series.to_numpy(dtype=np.float64), max_points)
+        payload['traces'].append({
+            'name': name,
+            'line': line,
+            'x': encode_dates(series.index[kept]),
+            'y': encode_floats(series.to_numpy(dtype=np.float64)[kept])
+        })
+    return payload
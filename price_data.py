@@ -0,0 +1,508 @@
+import contextlib
+import contextvars
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import FETCH_FAILURES, UPSTREAM_REQUESTS, UPSTREAM_RETRIES, span
+from shared_store import SharedPriceStore
+
+__all__ = [
+    'PriceDataProvider',
+    'YFinanceProvider',
+    'ColumnarPriceStore',
+    'ColumnarWriter',
+    'CachedProvider',
+    'OfflineProvider',
+    'SyntheticProvider',
+    'synthetic_prices',
+    'fetch_deadline',
+    'remaining_time',
+    'default_provider'
+]
+
+# Monotonic time by which every fetch of the current request must finish
+_deadline = contextvars.ContextVar('fetch_deadline', default=None)
+
+
+@contextlib.contextmanager
+def fetch_deadline(seconds):
+    """Give all the fetches made inside the block one shared time budget
+
+    Nested blocks can only shorten the budget. Threads started inside the
+    block only see it when they run in a copy of the caller's context.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left in the current fetch budget, or None outside of one"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _to_day(value):
+    """Normalize a date, datetime or string to a naive midnight Timestamp"""
+    day = pd.Timestamp(value)
+    if day.tzinfo is not None:
+        day = day.tz_localize(None)
+    return day.normalize()
+
+
+def _local_days(index):
+    """Return the exchange-local calendar day of every bar in the index"""
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize()
+
+
+def _slice_days(df, start_date, end_date):
+    """Return the bars of df with start_date <= day < end_date
+
+    Sorted bars are sliced by position, which keeps the result a view of df.
+    """
+    days = _local_days(df.index)
+    if days.is_monotonic_increasing:
+        start, end = days.searchsorted([_to_day(start_date), _to_day(end_date)])
+        return df.iloc[start:end]
+    return df[(days >= _to_day(start_date)) & (days < _to_day(end_date))]
+
+
+def _subtract_ranges(start, end, covered):
+    """Return the parts of [start, end) that are not inside any covered range"""
+    missing = []
+    cursor = start
+    for covered_start, covered_end in sorted(covered):
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+def _merge_ranges(ranges):
+    """Merge overlapping or touching [start, end) ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class PriceDataProvider:
+    """Source of daily OHLCV history for a ticker"""
+
+    def fetch(self, ticker, start_date, end_date):
+        """Return a DataFrame of bars with start_date <= day < end_date
+
+        A range without bars gives an empty DataFrame, a failed fetch None.
+        """
+        raise NotImplementedError
+
+
+def _no_bars(error):
+    """Whether yfinance raised because Yahoo answered with no bars for the range
+
+    Rate limiting adds a status code to the message and network errors
+    raise their own exception types, so both are failures.
+    """
+    message = str(error)
+    return type(error) is Exception and 'No price data found' in message and 'status_code' not in message
+
+
+class YFinanceProvider(PriceDataProvider):
+    """Download history from Yahoo Finance
+
+    A range Yahoo answers without bars gives an empty frame. Failed
+    attempts are retried with exponential backoff and full jitter, and no
+    fetch runs past ``deadline`` seconds in total, or past the end of the
+    request's fetch_deadline() budget if that comes first.
+    """
+
+    def __init__(self, max_retries=3, deadline=6.0, backoff=0.25, max_backoff=2.0):
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def fetch(self, ticker, start_date, end_date):
+        """Fetch data with retry logic"""
+        import yfinance as yf
+
+        budget = remaining_time()
+        give_up_at = time.monotonic() + (self.deadline if budget is None else min(self.deadline, budget))
+        for attempt in range(self.max_retries):
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                print(f"Deadline reached fetching {ticker}")
+                break
+            try:
+                print(f"Attempt {attempt + 1} to fetch data for {ticker}")
+                UPSTREAM_REQUESTS.inc()
+                if attempt > 0:
+                    UPSTREAM_RETRIES.inc()
+                # Without raise_errors yfinance turns network errors, timeouts
+                # and rate limiting into empty frames too
+                with span('upstream'):
+                    df = yf.Ticker(ticker).history(start=start_date, end=end_date, timeout=remaining,
+                                                   raise_errors=True)
+                if df.empty:
+                    raise ValueError("empty response")
+                print(f"Successfully fetched {len(df)} rows for {ticker}")
+                return df
+            except Exception as e:
+                if _no_bars(e):
+                    print(f"No rows for {ticker} from {start_date} to {end_date}")
+                    return pd.DataFrame(index=pd.DatetimeIndex([], name='Date'))
+                print(f"Error on attempt {attempt + 1} for {ticker}: {str(e)}")
+
+            if attempt < self.max_retries - 1:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                time.sleep(max(0, min(delay, give_up_at - time.monotonic())))
+        FETCH_FAILURES.inc()
+        return None
+
+
+class ColumnarPriceStore:
+    """On-disk columnar store of bars, one directory per symbol
+
+    Each column is a .npy file that is read back memory-mapped. meta.json
+    records the column names, the index timezone, the row count and the
+    calendar ranges that have already been fetched. The index holds UTC
+    nanoseconds, so the bars can be daily or intraday.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _symbol_dir(self, symbol):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9._^=-]', '_', symbol.upper()))
+
+    def open(self, symbol):
+        """Return (index, columns, meta) for a symbol as read-only memory maps, or None if not stored
+
+        index holds UTC nanoseconds as int64 and columns maps each column
+        name to its float64 values. Nothing is read until it is sliced.
+        """
+        symbol_dir = self._symbol_dir(symbol)
+        try:
+            with open(os.path.join(symbol_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            index = np.load(os.path.join(symbol_dir, 'index.npy'), mmap_mode='r')
+            columns = {
+                name: np.load(os.path.join(symbol_dir, f'{i}.npy'), mmap_mode='r')
+                for i, name in enumerate(meta['columns'])
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # A writer may be half way through replacing the files
+        if any(len(values) != meta['rows'] for values in [index, *columns.values()]):
+            return None
+        return index, columns, meta
+
+    def load(self, symbol):
+        """Return (frame, covered ranges) for a symbol, or (None, []) if not stored"""
+        stored = self.open(symbol)
+        if stored is None:
+            return None, []
+        index, columns, meta = stored
+
+        dates = pd.DatetimeIndex(np.asarray(index).view('datetime64[ns]'))
+        if meta['tz']:
+            dates = dates.tz_localize('UTC').tz_convert(meta['tz'])
+        frame = pd.DataFrame(columns, index=dates)
+        frame.index.name = 'Date'
+        covered = [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in meta['covered']]
+        return frame, covered
+
+    def save(self, symbol, frame, covered):
+        """Write a symbol's bars and covered ranges, replacing what was there"""
+        symbol_dir = self._symbol_dir(symbol)
+        os.makedirs(symbol_dir, exist_ok=True)
+
+        numeric = frame.select_dtypes(include=[np.number])
+        index = frame.index
+        tz = str(index.tz) if index.tz is not None else None
+        if tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+
+        arrays = {'index': index.values.astype('datetime64[ns]').view(np.int64)}
+        for i, name in enumerate(numeric.columns):
+            arrays[str(i)] = numeric[name].to_numpy(dtype=np.float64)
+        for name, values in arrays.items():
+            self._replace(os.path.join(symbol_dir, f'{name}.npy'), lambda f: np.save(f, values))
+
+        meta = {
+            'columns': [str(name) for name in numeric.columns],
+            'tz': tz,
+            'rows': len(frame),
+            'covered': [[start.isoformat(), end.isoformat()] for start, end in covered]
+        }
+        self._replace(os.path.join(symbol_dir, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+
+    def writer(self, symbol, columns, tz=None):
+        """Return a ColumnarWriter that replaces a symbol's bars with ones appended chunk by chunk"""
+        return ColumnarWriter(self, symbol, columns, tz)
+
+    def _replace(self, path, write):
+        """Write a file next to its destination and atomically move it into place"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class ColumnarWriter:
+    """Write a symbol's bars to a ColumnarPriceStore one chunk at a time
+
+    Chunks are appended to raw scratch files, so memory use does not grow
+    with the number of rows. close() turns them into the store's .npy
+    files and meta.json; leaving a with block on an exception discards
+    them instead.
+    """
+
+    def __init__(self, store, symbol, columns, tz=None):
+        self.store = store
+        self.columns = [str(name) for name in columns]
+        self.tz = tz
+        self.rows = 0
+        self.symbol_dir = store._symbol_dir(symbol)
+        os.makedirs(self.symbol_dir, exist_ok=True)
+        self._parts = {
+            name: tempfile.TemporaryFile(dir=self.symbol_dir)
+            for name in ['index', *map(str, range(len(self.columns)))]
+        }
+
+    def append(self, index, columns):
+        """Append bars given their UTC times as datetime64 or int64 nanoseconds and a dict of column values"""
+        index = np.asarray(index)
+        if index.dtype.kind == 'M':
+            index = index.astype('datetime64[ns]').view(np.int64)
+        self._parts['index'].write(np.ascontiguousarray(index, dtype='<i8').tobytes())
+        for i, name in enumerate(self.columns):
+            values = np.ascontiguousarray(columns[name], dtype='<f8')
+            if len(values) != len(index):
+                raise ValueError(f"Column '{name}' has {len(values)} values for {len(index)} bars")
+            self._parts[str(i)].write(values.tobytes())
+        self.rows += len(index)
+
+    def close(self):
+        """Move the appended bars into place, replacing the symbol's previous bars"""
+        for name, part in self._parts.items():
+            dtype = np.dtype('<i8' if name == 'index' else '<f8')
+
+            def write(f, part=part, dtype=dtype):
+                np.lib.format.write_array_header_1_0(f, {
+                    'descr': np.lib.format.dtype_to_descr(dtype),
+                    'fortran_order': False,
+                    'shape': (self.rows,)
+                })
+                part.seek(0)
+                shutil.copyfileobj(part, f, 1 << 20)
+
+            self.store._replace(os.path.join(self.symbol_dir, f'{name}.npy'), write)
+        meta = {'columns': self.columns, 'tz': self.tz, 'rows': self.rows, 'covered': []}
+        self.store._replace(os.path.join(self.symbol_dir, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+        self.discard()
+
+    def discard(self):
+        for part in self._parts.values():
+            part.close()
+        self._parts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+
+class CachedProvider(PriceDataProvider):
+    """Serve history from a local cache, fetching only missing ranges upstream
+
+    The cache is a SharedPriceStore, so every worker process on the host
+    reads the same copy of a symbol and sees it as soon as one of them has
+    fetched it.
+    """
+
+    def __init__(self, upstream, cache_dir):
+        self.upstream = upstream
+        self.store = SharedPriceStore.shared(cache_dir)
+
+    def fetch(self, ticker, start_date, end_date):
+        start, end = _to_day(start_date), _to_day(end_date)
+        cached, covered = self.store.load(ticker)
+
+        # Today's bar is still moving, so only ranges before today count as covered
+        today = _to_day(datetime.now())
+        fetched = []
+        updated = failed = False
+        for missing_start, missing_end in _subtract_ranges(start, end, covered):
+            if len(pd.bdate_range(missing_start, missing_end - pd.Timedelta(days=1))) == 0:
+                # Weekends have no bars, there is nothing to fetch
+                covered.append((missing_start, missing_end))
+                updated = True
+                continue
+
+            if remaining_time() == 0:
+                print(f"Fetch budget spent, serving cached {ticker} without {missing_start.date()} to {missing_end.date()}")
+                failed = True
+                break
+
+            print(f"Cache miss for {ticker} from {missing_start.date()} to {missing_end.date()}")
+            df = self.upstream.fetch(ticker, missing_start, missing_end)
+            if df is None:
+                # Nothing new could be fetched, serve whatever the cache has
+                failed = True
+                continue
+            # An empty frame means the range has no bars, which is cached like any other answer
+            fetched.append(df)
+            if missing_start < min(missing_end, today):
+                covered.append((missing_start, min(missing_end, today)))
+            updated = True
+
+        if updated:
+            frames = [frame for frame in [cached, *fetched] if frame is not None and not frame.empty]
+            if frames:
+                merged = pd.concat(frames)
+                merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+            else:
+                merged = pd.DataFrame(index=pd.DatetimeIndex([], name='Date'))
+            cached = merged
+            try:
+                self.store.save(ticker, merged, _merge_ranges(covered))
+                # Serve the shared copy so this process does not keep its own
+                cached, _ = self.store.load(ticker)
+            except Exception as e:
+                print(f"Error writing price cache for {ticker}: {str(e)}")
+
+        if cached is None:
+            return None
+        df = _slice_days(cached, start, end)
+        return None if df.empty and failed else df
+
+
+class OfflineProvider(PriceDataProvider):
+    """Serve history from local files with no network access
+
+    data_dir may contain a cache written by CachedProvider, a
+    ColumnarPriceStore and/or one <SYMBOL>.csv file per ticker with a Date
+    column followed by OHLCV columns.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.shared_store = SharedPriceStore.shared(data_dir)
+        self.store = ColumnarPriceStore(data_dir)
+
+    def fetch(self, ticker, start_date, end_date):
+        df, _ = self.shared_store.load(ticker)
+        if df is None:
+            df, _ = self.store.load(ticker)
+        if df is None:
+            csv_path = os.path.join(self.data_dir, f'{ticker.upper()}.csv')
+            if not os.path.exists(csv_path):
+                print(f"No local data for {ticker} in {self.data_dir}")
+                return None
+            df = pd.read_csv(csv_path, index_col=0)
+            # Dates written with UTC offsets change offset with daylight saving time
+            df.index = pd.to_datetime(df.index, utc=True)
+        return _slice_days(df, start_date, end_date)
+
+
+def _bar_index(start, n_bars, freq):
+    """Return n_bars timestamps from start, building weekday ranges with NumPy"""
+    if freq != 'B':
+        return pd.date_range(start, periods=n_bars, freq=freq, name='Date')
+    days = np.datetime64(pd.Timestamp(start).date(), 'D') + np.arange(n_bars * 7 // 5 + 7)
+    return pd.DatetimeIndex(days[np.is_busday(days)][:n_bars], name='Date')
+
+
+def synthetic_prices(n_bars, seed=0, start='2000-01-03', freq='B', mu=0.07, sigma=0.2, initial_price=100.0):
+    """Generate OHLCV bars following geometric Brownian motion
+
+    mu and sigma are the annual drift and volatility, with 252 bars per
+    year. The same seed always gives the same bars.
+    """
+    rng = np.random.default_rng(seed)
+    dt = 1 / 252
+    log_returns = (mu - sigma ** 2 / 2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(n_bars)
+    close = initial_price * np.exp(np.cumsum(log_returns))
+    open_ = np.concatenate(([initial_price], close[:-1]))
+    spread = np.abs(rng.standard_normal(n_bars)) * sigma * np.sqrt(dt) / 2
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * (1 + spread),
+        'Low': np.minimum(open_, close) * (1 - spread),
+        'Close': close,
+        'Volume': rng.integers(100000, 10000000, n_bars).astype(np.float64)
+    }, index=_bar_index(start, n_bars, freq))
+
+
+class SyntheticProvider(PriceDataProvider):
+    """Serve seeded synthetic daily bars for any ticker, with no network or files
+
+    Every ticker gets its own random walk from 1970 onwards, so a given
+    ticker and date always have the same price whatever range is requested.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def fetch(self, ticker, start_date, end_date):
+        end = _to_day(end_date)
+        n_bars = int(np.busday_count(np.datetime64('1970-01-01'), np.datetime64(end.date(), 'D')))
+        # Ranges before 1970 slice an empty frame out of the first bar
+        df = synthetic_prices(max(n_bars, 1), seed=(zlib.crc32(ticker.upper().encode()), self.seed), start='1970-01-01')
+        return _slice_days(df, start_date, end)
+
+
+def default_provider():
+    """Build the provider configured by the environment
+
+    PRICE_DATA_SOURCE=synthetic serves generated prices seeded by
+    PRICE_DATA_SEED. PRICE_DATA_DIR switches to offline mode over local
+    files. Otherwise Yahoo Finance is used behind the cache in
+    PRICE_CACHE_DIR, which defaults to a directory under the system temp
+    dir.
+    """
+    if os.environ.get('PRICE_DATA_SOURCE') == 'synthetic':
+        return SyntheticProvider(seed=int(os.environ.get('PRICE_DATA_SEED', 0)))
+    data_dir = os.environ.get('PRICE_DATA_DIR')
+    if data_dir:
+        return OfflineProvider(data_dir)
+    cache_dir = os.environ.get('PRICE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'kailash-prices')
+    return CachedProvider(YFinanceProvider(), cache_dir)
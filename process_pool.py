@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+__all__ = ['POOL_SIZE', 'shared_pool', 'submit', 'map_tasks']
+
+# Worker processes in the pool shared by batches, sweeps and Monte Carlo runs
+POOL_SIZE = int(os.environ.get('PROCESS_POOL_SIZE') or os.cpu_count() or 1)
+
+_pool = None
+_lock = threading.Lock()
+
+
+def _context():
+    # Forking a threaded web worker can copy locks held by other threads, so
+    # workers start from a clean server process (or a fresh interpreter)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def shared_pool(replace=None):
+    """Return the process-wide pool, creating it on first use
+
+    Passing the pool that broke replaces it with a new one.
+    """
+    global _pool
+    with _lock:
+        if _pool is None or _pool is replace:
+            if replace is not None:
+                replace.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=POOL_SIZE, mp_context=_context())
+        return _pool
+
+
+def submit(fn, *args):
+    """Submit fn(*args) to the shared pool, replacing the pool if a worker died"""
+    pool = shared_pool()
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        return shared_pool(replace=pool).submit(fn, *args)
+
+
+def map_tasks(fn, tasks):
+    """Return [fn(task) for task in tasks], computed in the shared pool"""
+    pool = shared_pool()
+    try:
+        return list(pool.map(fn, tasks))
+    except BrokenProcessPool:
+        return list(shared_pool(replace=pool).map(fn, tasks))
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['fingerprint_prices', 'analysis_key', 'make_result_id', 'parse_result_id', 'ResultCache', 'RESULT_CACHE']
+
+
+def fingerprint_prices(*frames):
+    """Hash the dates and closing prices of one or more price frames"""
+    digest = hashlib.blake2b(digest_size=16)
+    for df in frames:
+        digest.update(np.ascontiguousarray(df.index.asi8).tobytes())
+        digest.update(np.ascontiguousarray(df['Close'].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def analysis_key(strategy, stock_data, sp500_data):
+    """Return a key for an analysis from its normalized parameters and the price data"""
+    start_date, end_date = strategy.get_date_range()
+    params = {
+        'stock_symbol': str(strategy.stock_symbol).upper(),
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'initial_investment': float(strategy.initial_investment),
+        'shares_small_move': int(strategy.shares_small_move),
+        'shares_large_move': int(strategy.shares_large_move),
+        'consecutive_days': int(strategy.consecutive_days),
+        'large_move_threshold': float(strategy.large_move_threshold),
+        'engine': strategy.engine,
+        'plot_mode': strategy.plot_mode,
+        'prices': fingerprint_prices(stock_data, sp500_data)
+    }
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def make_result_id(key, strategy):
+    """Return the ID clients use to download a result
+
+    It is the analysis key followed by the form fields of the analysis, so
+    a worker that does not hold the result can recompute it.
+    """
+    start_date, end_date = strategy.get_date_range()
+    params = {
+        'stock_symbol': str(strategy.stock_symbol).upper(),
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'initial_investment': str(strategy.initial_investment),
+        'shares_small_move': str(strategy.shares_small_move),
+        'shares_large_move': str(strategy.shares_large_move),
+        'consecutive_days': str(strategy.consecutive_days),
+        'large_move_threshold': str(strategy.large_move_threshold),
+        'plot_mode': strategy.plot_mode
+    }
+    token = base64.urlsafe_b64encode(json.dumps(params, separators=(',', ':')).encode()).decode().rstrip('=')
+    return f'{key}.{token}'
+
+
+def parse_result_id(result_id):
+    """Return (key, form fields) of a result ID, with None for fields that cannot be read"""
+    key, _, token = result_id.partition('.')
+    try:
+        params = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return key, None
+    return key, params if isinstance(params, dict) else None
+
+
+def _entry_size(entry):
+    """Rough size in bytes of a cached analysis, dominated by the plot and ledger"""
+    results = entry['results']
+    plot_data = results.get('plot_data') or {'traces': []}
+    plot_size = sum(len(trace['y']) + 8 * len(trace['x']['deltas']) for trace in plot_data['traces'])
+    return len(results.get('plot_html', '')) + plot_size + entry['ledger'].nbytes
+
+
+class ResultCache:
+    """Thread-safe LRU cache of analyses bounded by entry count and approximate bytes
+
+    Each entry is a dict with the JSON-ready 'results' of analyze() and the
+    run's columnar 'ledger', keyed by analysis_key, which doubles as the
+    result ID clients use to download the trades.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached entry for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, entry):
+        """Store an entry, evicting the least recently used ones to stay within bounds"""
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[0]
+            self._entries[key] = (size, entry)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,244 @@
+import contextlib
+import fcntl
+import json
+import mmap
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+__all__ = ['SharedPriceStore']
+
+# Records start on this boundary so their arrays can be viewed in place
+ALIGNMENT = 64
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class SharedPriceStore:
+    """Price store that every process on a host reads zero-copy through memory-mapped segments
+
+    A symbol's bars are one record in an append-only segment file: the
+    index as int64 UTC nanoseconds, then the numeric columns as one
+    (columns, rows) float64 block. index.json maps each symbol to its
+    segment, offset, shape, timezone and covered ranges. load() returns a
+    DataFrame of read-only views into the map, so every process shares the
+    same pages of the OS page cache instead of holding its own copy.
+
+    Writers take an exclusive lock on the store, append the new record and
+    then atomically replace index.json, so other processes see the symbol
+    as soon as save() returns and never see a partial record. Replacing a
+    symbol leaves its old record in place for readers still using it, and
+    segments are started every segment_size bytes. Once the replaced
+    records add up to more than compact_threshold bytes, the live records
+    are copied into fresh segments and the old segments are deleted.
+    Processes that still map a deleted segment keep reading it until they
+    next load from the store.
+    """
+
+    _shared = {}
+
+    def __init__(self, root, segment_size=256 * 1024 * 1024, compact_threshold=64 * 1024 * 1024):
+        self.root = root
+        self.segment_size = segment_size
+        self.compact_threshold = compact_threshold
+        self._entries = {}
+        self._stamp = None
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, root):
+        """Return this process's store for root, so its maps are reused across requests"""
+        root = os.path.abspath(root)
+        store = cls._shared.get(root)
+        if store is None:
+            store = cls._shared.setdefault(root, cls(root))
+        return store
+
+    def _key(self, symbol):
+        return re.sub(r'[^A-Za-z0-9._^=-]', '_', symbol.upper())
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _read_index(self, force=False):
+        """Return the symbol index, re-reading it only when another process has replaced it"""
+        try:
+            stat = os.stat(self._path('index.json'))
+        except FileNotFoundError:
+            return {}
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if force or stamp != self._stamp:
+                try:
+                    with open(self._path('index.json')) as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError):
+                    return {}
+                self._stamp = stamp
+
+                # Let go of segments that were compacted away, frames still using them keep them alive
+                used = {entry['segment'] for entry in self._entries.values()}
+                self._maps = {name: mapped for name, mapped in self._maps.items() if name in used}
+            return self._entries
+
+    def _segment(self, name, end):
+        """Return a read-only map of a segment that covers its first end bytes"""
+        with self._lock:
+            mapped = self._maps.get(name)
+            if mapped is None or len(mapped) < end:
+                # Segments only grow, so a map taken before the last append is replaced
+                with open(self._path(name), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[name] = mapped
+            return mapped
+
+    def symbols(self):
+        """Return the symbols currently stored"""
+        return sorted(self._read_index())
+
+    def load(self, symbol):
+        """Return (frame, covered ranges) for a symbol, or (None, []) if not stored
+
+        The frame's columns are read-only views into the shared segment.
+        """
+        key = self._key(symbol)
+        for force in (False, True):
+            entry = self._read_index(force).get(key)
+            if entry is None:
+                return None, []
+            if not entry['nbytes']:
+                # A symbol with no bars in its covered ranges has nothing to map
+                mapped = b''
+                break
+            try:
+                mapped = self._segment(entry['segment'], entry['offset'] + entry['nbytes'])
+                break
+            except (OSError, ValueError):
+                # The segment was deleted after this process last read the index
+                continue
+        else:
+            return None, []
+
+        rows, columns = entry['rows'], entry['columns']
+        index = np.frombuffer(mapped, dtype='<i8', count=rows, offset=entry['offset'])
+        block = np.frombuffer(mapped, dtype='<f8', count=rows * len(columns),
+                              offset=entry['offset'] + _aligned(8 * rows)).reshape(len(columns), rows)
+
+        dates = pd.DatetimeIndex(index.view('datetime64[ns]'), name='Date')
+        if entry['tz']:
+            dates = dates.tz_localize('UTC').tz_convert(entry['tz'])
+        frame = pd.DataFrame(block.T, index=dates, columns=columns, copy=False)
+        covered = [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in entry['covered']]
+        return frame, covered
+
+    def save(self, symbol, frame, covered):
+        """Write a symbol's bars and covered ranges, replacing what was there"""
+        numeric = frame.select_dtypes(include=[np.number])
+        index = frame.index
+        tz = str(index.tz) if index.tz is not None else None
+        if tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        index = np.ascontiguousarray(index.values.astype('datetime64[ns]').view('<i8'))
+        block = np.ascontiguousarray(numeric.to_numpy(dtype='<f8').T)
+        record = [index.tobytes(), b'\0' * (_aligned(index.nbytes) - index.nbytes), block.tobytes()]
+
+        os.makedirs(self.root, exist_ok=True)
+        with self._writer_lock():
+            entries = dict(self._read_index(force=True))
+            segment, offset = self._append(record)
+            entries[self._key(symbol)] = {
+                'segment': segment,
+                'offset': offset,
+                'nbytes': _aligned(index.nbytes) + block.nbytes,
+                'rows': len(index),
+                'columns': [str(name) for name in numeric.columns],
+                'tz': tz,
+                'covered': [[start.isoformat(), end.isoformat()] for start, end in covered]
+            }
+            if self._dead_bytes(entries) > self.compact_threshold:
+                entries, segment = self._copy_live_records(entries)
+            self._write_index(entries)
+            self._remove_unused_segments(entries, segment)
+
+    def compact(self):
+        """Copy the live records into fresh segments and delete the old ones"""
+        if not os.path.isdir(self.root):
+            return
+        with self._writer_lock():
+            entries, segment = self._copy_live_records(dict(self._read_index(force=True)))
+            self._write_index(entries)
+            self._remove_unused_segments(entries, segment)
+
+    @contextlib.contextmanager
+    def _writer_lock(self):
+        with open(self._path('lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.root) if re.fullmatch(r'segment-\d+\.bin', name))
+
+    def _dead_bytes(self, entries):
+        """Bytes of the segments no longer pointed to by any symbol"""
+        total = sum(os.path.getsize(self._path(name)) for name in self._segments())
+        return total - sum(entry['nbytes'] for entry in entries.values())
+
+    def _append(self, record, fresh=False):
+        """Append one record, given as its parts, to the active segment and return (segment, offset)
+
+        The record goes to a new segment when it would overflow the active
+        one, or always when fresh is set.
+        """
+        segments = self._segments()
+        number = int(segments[-1][8:-4]) if segments else 0
+        size = os.path.getsize(self._path(segments[-1])) if segments else 0
+        nbytes = sum(len(part) for part in record)
+        if fresh or not segments or (size and _aligned(size) + nbytes > self.segment_size):
+            number, size = number + 1, 0
+        segment = f'segment-{number:06d}.bin'
+
+        offset = _aligned(size)
+        with open(self._path(segment), 'ab') as f:
+            f.write(b'\0' * (offset - size))
+            for part in record:
+                f.write(part)
+        return segment, offset
+
+    def _copy_live_records(self, entries):
+        """Copy every symbol's record into new segments, returning the updated entries and the active segment"""
+        print(f"Compacting price store {self.root}")
+        compacted = {}
+        segment = None
+        for key, entry in sorted(entries.items(), key=lambda item: (item[1]['segment'], item[1]['offset'])):
+            with open(self._path(entry['segment']), 'rb') as f:
+                record = os.pread(f.fileno(), entry['nbytes'], entry['offset'])
+            segment, offset = self._append([record], fresh=segment is None)
+            compacted[key] = dict(entry, segment=segment, offset=offset)
+        return compacted, segment
+
+    def _write_index(self, entries):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self._path('index.json'))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _remove_unused_segments(self, entries, active):
+        # Processes that still map a deleted segment keep reading it until they let go
+        used = {entry['segment'] for entry in entries.values()} | {active}
+        for name in self._segments():
+            if name not in used:
+                try:
+                    os.unlink(self._path(name))
+                except OSError:
+                    pass
@@ -0,0 +1,50 @@
+import numpy as np
+
+from backtest_engine import run_backtest
+from trade_ledger import TradeLedger
+
+__all__ = ['percent_change', 'summarize', 'analyze_closes']
+
+
+def percent_change(start, end):
+    """Percentage change from start to end"""
+    return ((end - start) / start) * 100
+
+
+def summarize(initial_investment, final_value, benchmark_close, trades, last_n=5):
+    """Format the headline numbers of a run the way analyze() returns them
+
+    trades is a TradeLedger or a list of trade dicts.
+    """
+    total_return = percent_change(initial_investment, final_value)
+    sp500_return = percent_change(benchmark_close[0], benchmark_close[-1])
+    return {
+        'initial_investment': f'${initial_investment:,.2f}',
+        'final_value': f'${final_value:,.2f}',
+        'total_return': f'{total_return:.2f}%',
+        'sp500_return': f'{sp500_return:.2f}%',
+        'number_of_trades': len(trades),
+        'last_trades': trades[-last_n:]
+    }
+
+
+def analyze_closes(dates, close, benchmark_close, initial_investment, shares_small_move, shares_large_move,
+                   consecutive_days, large_move_threshold=5):
+    """Run the strategy over plain arrays of dates and closes and summarize it
+
+    This is analyze() without data providers, pandas or plotting, for
+    callers that only need the numbers. dates are datetime64 values for
+    the closes; benchmark_close is the S&P 500 over the same period.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    benchmark_close = np.asarray(benchmark_close, dtype=np.float64)
+    if len(benchmark_close) == 0:
+        return {'error': 'Unable to fetch S&P 500 data'}
+    if len(close) <= consecutive_days:
+        return {'error': f'Not enough data for {consecutive_days} consecutive days'}
+
+    result = run_backtest(close, consecutive_days, shares_small_move, shares_large_move, initial_investment,
+                          large_move_threshold)
+    trades = TradeLedger(np.asarray(dates)[result['bars']], result['sides'], result['shares'],
+                         result['prices'], result['moves'])
+    return summarize(initial_investment, result['final_value'], benchmark_close, trades)
@@ -0,0 +1,54 @@
+import numpy as np
+
+__all__ = ['StrategyState']
+
+
+class StrategyState:
+    """Serializable snapshot of a strategy run that can be advanced with new bars"""
+
+    def __init__(self, cash, shares=0, consecutive_up_days=0, consecutive_down_days=0, last_price=None,
+                 trade_cursor=0, bars_seen=0, bars_evaluated=0, tail_dates=(), tail_closes=()):
+        self.cash = cash
+        self.shares = shares
+        self.consecutive_up_days = consecutive_up_days
+        self.consecutive_down_days = consecutive_down_days
+        self.last_price = last_price
+        self.trade_cursor = trade_cursor
+        # Number of bars received and number of bars the strategy has evaluated
+        self.bars_seen = bars_seen
+        self.bars_evaluated = bars_evaluated
+        # Dates and closes of the most recent bars, ending with the last one seen, which the
+        # move windows of the bars not evaluated yet still reach back into
+        self.tail_dates = np.asarray(tail_dates, dtype='datetime64[ns]')
+        self.tail_closes = np.asarray(tail_closes, dtype=np.float64)
+
+    @property
+    def portfolio_value(self):
+        """Cash plus shares valued at the last evaluated price"""
+        if self.last_price is None:
+            return self.cash
+        return self.cash + (self.shares * self.last_price)
+
+    @property
+    def last_seen(self):
+        """Date of the last bar received, or None"""
+        return self.tail_dates[-1] if len(self.tail_dates) else None
+
+    def to_dict(self):
+        """Return the state as JSON-serializable values"""
+        return {
+            'cash': self.cash,
+            'shares': self.shares,
+            'consecutive_up_days': self.consecutive_up_days,
+            'consecutive_down_days': self.consecutive_down_days,
+            'last_price': self.last_price,
+            'trade_cursor': self.trade_cursor,
+            'bars_seen': self.bars_seen,
+            'bars_evaluated': self.bars_evaluated,
+            'tail_dates': np.datetime_as_string(self.tail_dates).tolist(),
+            'tail_closes': self.tail_closes.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
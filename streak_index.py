@@ -0,0 +1,163 @@
+import threading
+
+import numpy as np
+
+from backtest_engine import BUY, SELL
+from benchmark_cache import TTLCache
+
+__all__ = ['StreakIndex', 'StreakIndexCache', 'STREAK_INDEXES']
+
+
+def _runs(close):
+    """Run-length encode the up/down direction of every bar after the first
+
+    Returns the first bar, the bar after the last and the direction of
+    every run, with bars numbered from the first close.
+    """
+    is_up = np.diff(close) > 0
+    if not len(is_up):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+    run_starts = np.flatnonzero(np.concatenate(([True], is_up[1:] != is_up[:-1])))
+    return run_starts + 1, np.append(run_starts[1:], len(is_up)) + 1, is_up[run_starts]
+
+
+class StreakIndex:
+    """Run-length encoded up/down streaks of a price series
+
+    Every run of up days (close strictly above the previous close) or down
+    days is stored once with its start and end bar, so the signal bars for
+    any consecutive_days value are read off the runs at least that long
+    instead of rescanning every bar. Signals can be looked up for any
+    window of the series, which is how one index serves every date range
+    requested for a symbol.
+
+    An index is never modified: extended() returns a new index that reuses
+    the runs already encoded and only encodes the new bars.
+    """
+
+    def __init__(self, close, dates=None, runs=None):
+        self.close = np.asarray(close, dtype=np.float64)
+        self.dates = None if dates is None else np.asarray(dates, dtype='datetime64[ns]')
+        self.starts, self.ends, self.up = runs if runs is not None else _runs(self.close)
+        self._signals = {}
+
+    def __len__(self):
+        return len(self.close)
+
+    def extended(self, close, dates=None):
+        """Return an index with the given bars appended after the last one"""
+        close = np.asarray(close, dtype=np.float64)
+        if not len(close):
+            return self
+        starts, ends, up = _runs(np.concatenate((self.close[-1:], close)))
+        starts, ends = starts + len(self) - 1, ends + len(self) - 1
+        if len(self.up) and self.up[-1] == up[0]:
+            # The new bars continue the last streak
+            prefix = (self.starts, np.append(self.ends[:-1], ends[0]), self.up)
+            starts, ends, up = starts[1:], ends[1:], up[1:]
+        else:
+            prefix = (self.starts, self.ends, self.up)
+        runs = tuple(np.concatenate((old, new)) for old, new in zip(prefix, (starts, ends, up)))
+        if self.dates is not None and dates is not None:
+            dates = np.concatenate((self.dates, np.asarray(dates, dtype='datetime64[ns]')))
+        else:
+            dates = None
+        return StreakIndex(np.concatenate((self.close, close)), dates, runs)
+
+    def align(self, dates, close):
+        """Find a price series in the index
+
+        Returns (offset, new bars) when the series starts at an indexed bar
+        and matches the index up to its end, where the new bars are the
+        ones past the end of the index, otherwise None.
+        """
+        if self.dates is None or not len(dates):
+            return None
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        close = np.asarray(close, dtype=np.float64)
+        offset = int(np.searchsorted(self.dates, dates[0]))
+        if offset == len(self) or self.dates[offset] != dates[0]:
+            return None
+        overlap = min(len(self) - offset, len(dates))
+        if not (np.array_equal(self.dates[offset:offset + overlap], dates[:overlap])
+                and np.array_equal(self.close[offset:offset + overlap], close[:overlap])):
+            return None
+        return offset, len(dates) - overlap
+
+    def signals(self, consecutive_days, shares_small_move, shares_large_move, large_move_threshold=5,
+                start=0, stop=None):
+        """Return the candidate signals of bars start to stop, like find_signals over those closes
+
+        Bars are numbered from start. A bar is a signal once it is the
+        consecutive_days-th bar of its run or later, counting the run from
+        start + 1, and only bars with a close consecutive_days bars ahead
+        are evaluated.
+        """
+        stop = len(self) if stop is None else stop
+        key = (consecutive_days, start, stop)
+        found = self._signals.get(key)
+        if found is None:
+            if len(self._signals) >= 64:
+                self._signals.clear()
+            found = self._signals[key] = self._find(consecutive_days, start, stop)
+        bars, sides, moves = found
+        shares = np.where(np.abs(moves) >= large_move_threshold, shares_large_move, shares_small_move)
+        return bars, sides, moves, shares
+
+    def _find(self, consecutive_days, start, stop):
+        first, last = start + 1, stop - consecutive_days
+        lo = np.searchsorted(self.ends, first, side='right')
+        hi = max(np.searchsorted(self.starts, last), lo)
+
+        # Runs are cut at the window so a streak never counts bars before it
+        run_starts = np.maximum(self.starts[lo:hi], first)
+        run_ends = np.minimum(self.ends[lo:hi], last)
+        first_signals = run_starts + consecutive_days - 1
+        long_enough = first_signals < run_ends
+        first_signals = first_signals[long_enough]
+        counts = run_ends[long_enough] - first_signals
+
+        # Every bar from a run's first signal to its end
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        bars = np.repeat(first_signals, counts) + offsets
+        sides = np.repeat(np.where(self.up[lo:hi][long_enough], SELL, BUY), counts)
+
+        # Percentage move over the window starting consecutive_days - 1 bars back
+        start_prices = self.close[bars - consecutive_days + 1]
+        end_prices = self.close[bars + 1]
+        moves = ((end_prices - start_prices) / start_prices) * 100
+        return bars - start, sides, moves
+
+
+class StreakIndexCache:
+    """Process-wide streak indexes keyed by symbol
+
+    A series that continues the cached one extends it with just the new
+    bars; one that starts before it or disagrees with it (revised prices)
+    replaces it.
+    """
+
+    def __init__(self, maxsize=64, ttl=3600):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, symbol, dates, close):
+        """Return (index, offset of the series in it) for a symbol's price series"""
+        with self._lock:
+            hit, index = self.cache.get(symbol)
+            aligned = index.align(dates, close) if hit else None
+            if aligned is None:
+                index, offset = StreakIndex(close, dates), 0
+                self.cache.set(symbol, index)
+            else:
+                offset, new = aligned
+                if new:
+                    index = index.extended(np.asarray(close)[-new:], np.asarray(dates)[-new:])
+                    self.cache.set(symbol, index)
+            return index, offset
+
+    def clear(self):
+        self.cache.clear()
+
+
+STREAK_INDEXES = StreakIndexCache()
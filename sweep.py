@@ -0,0 +1,148 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from backtest_engine import SELL, find_signals
+from plot_payload import figure_html
+from process_pool import POOL_SIZE, map_tasks
+from streak_index import StreakIndex
+
+__all__ = ['MAX_SWEEP_COMBINATIONS', 'PARAMETERS', 'simulate_batch', 'run_sweep', 'create_sweep_heatmap']
+
+# Upper bound on the grid size accepted by run_sweep
+MAX_SWEEP_COMBINATIONS = 100000
+
+# Number of combinations simulated together in one task
+CHUNK_SIZE = 4096
+
+# Columns of the result table that can be swept and used as heatmap axes
+PARAMETERS = ['consecutive_days', 'shares_small_move', 'shares_large_move', 'large_move_threshold']
+
+
+def simulate_batch(close, consecutive_days, shares_small_move, shares_large_move, large_move_thresholds,
+                   initial_investment, signals=None):
+    """Simulate many share-size/threshold combinations for one consecutive_days value
+
+    shares_small_move, shares_large_move and large_move_thresholds are
+    arrays with one entry per combination. The signal bars only depend on
+    consecutive_days, so they are found once and every combination is
+    filled together as a vector. signals are the (bars, sides, moves) of
+    those bars when they have already been looked up. Returns the final
+    values and trade counts.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    shares_small_move = np.asarray(shares_small_move, dtype=np.int64)
+    shares_large_move = np.asarray(shares_large_move, dtype=np.int64)
+    large_move_thresholds = np.asarray(large_move_thresholds, dtype=np.float64)
+
+    if signals is None:
+        signals = find_signals(close, consecutive_days, 0, 0)[:3]
+    bars, sides, moves = signals
+    cash = np.full(len(shares_small_move), initial_investment, dtype=np.float64)
+    held = np.zeros(len(shares_small_move), dtype=np.int64)
+    trades = np.zeros(len(shares_small_move), dtype=np.int64)
+
+    for side, price, movement in zip(sides.tolist(), close[bars].tolist(), np.abs(moves).tolist()):
+        wanted = np.where(movement >= large_move_thresholds, shares_large_move, shares_small_move)
+        if side == SELL:
+            # A sell is recorded whenever shares are held, even if it sells none of them
+            filled = held > 0
+            quantity = np.minimum(held, wanted)
+            cash = cash + quantity * price
+            held = held - quantity
+        else:
+            quantity = np.maximum(np.minimum(wanted, np.floor(cash / price).astype(np.int64)), 0)
+            filled = quantity > 0
+            cash = cash - quantity * price
+            held = held + quantity
+        trades += filled
+
+    last_price = close[len(close) - consecutive_days - 1]
+    return cash + (held * last_price), trades
+
+
+def _run_chunk(args):
+    """Process pool entry point: simulate one chunk of the grid"""
+    close, consecutive_days, signals, combos, initial_investment = args
+    final_values, trades = simulate_batch(
+        close, consecutive_days, combos[:, 0], combos[:, 1], combos[:, 2], initial_investment, signals
+    )
+    return consecutive_days, combos, final_values, trades
+
+
+def run_sweep(close, initial_investment, consecutive_days, shares_small_move, shares_large_move,
+              large_move_thresholds=(5,), processes=None):
+    """Evaluate every combination of the given parameter values over one price series
+
+    Each parameter takes a list of values. The grid is split by
+    consecutive_days and into chunks of CHUNK_SIZE combinations, which are
+    spread over the shared process pool, or run in this process when
+    ``processes`` is 1. Returns a DataFrame with one row per combination, ranked by
+    total return.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    consecutive_days = sorted({int(days) for days in consecutive_days if 0 < int(days) < len(close)})
+    grid = np.array(
+        list(itertools.product(shares_small_move, shares_large_move, large_move_thresholds)),
+        dtype=np.float64
+    ).reshape(-1, 3)
+    if not consecutive_days or not len(grid):
+        raise ValueError('The parameter grid is empty')
+    if len(consecutive_days) * len(grid) > MAX_SWEEP_COMBINATIONS:
+        raise ValueError(f'The parameter grid has more than {MAX_SWEEP_COMBINATIONS} combinations')
+
+    # The streaks are encoded once and the signals of every consecutive_days value read off them
+    index = StreakIndex(close)
+    signals = {days: index.signals(days, 0, 0)[:3] for days in consecutive_days}
+    tasks = [
+        (close, days, signals[days], grid[start:start + CHUNK_SIZE], initial_investment)
+        for days in consecutive_days
+        for start in range(0, len(grid), CHUNK_SIZE)
+    ]
+    if (processes or POOL_SIZE) > 1 and len(tasks) > 1:
+        chunks = map_tasks(_run_chunk, tasks)
+    else:
+        chunks = [_run_chunk(task) for task in tasks]
+
+    table = pd.concat([
+        pd.DataFrame({
+            'consecutive_days': days,
+            'shares_small_move': combos[:, 0].astype(np.int64),
+            'shares_large_move': combos[:, 1].astype(np.int64),
+            'large_move_threshold': combos[:, 2],
+            'final_value': final_values,
+            'total_return': ((final_values - initial_investment) / initial_investment) * 100,
+            'number_of_trades': trades
+        })
+        for days, combos, final_values, trades in chunks
+    ], ignore_index=True)
+    return table.sort_values('total_return', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def create_sweep_heatmap(table, x='shares_small_move', y='shares_large_move'):
+    """Create a heatmap of the best total return for each pair of x and y values
+
+    The other parameters are maximised over, so every cell shows the best
+    return reachable with that x and y.
+    """
+    import plotly.graph_objects as go
+
+    try:
+        best = table.pivot_table(index=y, columns=x, values='total_return', aggfunc='max')
+        fig = go.Figure(go.Heatmap(
+            x=best.columns,
+            y=best.index,
+            z=best.values,
+            colorscale='RdYlGn',
+            colorbar=dict(title='Return (%)')
+        ))
+        fig.update_layout(
+            title='Best Total Return by Parameter',
+            xaxis_title=x,
+            yaxis_title=y
+        )
+        return figure_html(fig)
+    except Exception as e:
+        print(f"Error creating sweep heatmap: {str(e)}")
+        return "<p>Error creating sweep heatmap</p>"
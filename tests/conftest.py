@@ -0,0 +1,53 @@
+import os
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def random_closes(rng, n_bars):
+    """Random closes rounded to whole dollars, so equal closes are common"""
+    steps = rng.integers(-3, 4, n_bars) * rng.choice([1.0, 0.5], n_bars)
+    return np.maximum(np.round(50 + np.cumsum(steps)), 1.0)
+
+
+def price_frame(close, start='2010-01-04'):
+    """Daily price frame with the given closes on consecutive business days"""
+    return pd.DataFrame({'Close': np.asarray(close, dtype=np.float64)},
+                        index=pd.bdate_range(start, periods=len(close), name='Date'))
+
+
+@pytest.fixture
+def rng(request):
+    """Random generator seeded by the test's name, so every run sees the same series"""
+    return np.random.default_rng(zlib.crc32(request.node.name.encode()))
+
+
+# Form fields of an analysis the synthetic price source can answer offline
+ANALYSIS_FORM = {
+    'initial_investment': '10000',
+    'shares_small_move': '10',
+    'shares_large_move': '20',
+    'consecutive_days': '2',
+    'stock_symbol': 'TEST',
+    'start_date': '2015-01-01',
+    'end_date': '2020-01-01'
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client over synthetic prices, with every process-wide cache empty"""
+    monkeypatch.setenv('PRICE_DATA_SOURCE', 'synthetic')
+    from app import app
+    from benchmark_cache import BENCHMARK_CACHE
+    from result_cache import RESULT_CACHE
+    from streak_index import STREAK_INDEXES
+    for cache in (RESULT_CACHE, BENCHMARK_CACHE.cache, STREAK_INDEXES):
+        cache.clear()
+    return app.test_client()
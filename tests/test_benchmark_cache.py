@@ -0,0 +1,149 @@
+import threading
+import time
+import types
+
+import pytest
+
+import benchmark_cache
+from benchmark_cache import BenchmarkCache, SingleFlight, TTLCache
+from price_data import SyntheticProvider
+
+CALLERS = 16
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock for benchmark_cache that only moves when the test says so"""
+    fake = types.SimpleNamespace(now=0.0)
+    fake.monotonic = lambda: fake.now
+    monkeypatch.setattr(benchmark_cache, 'time', fake)
+    return fake
+
+
+def run_together(fn, n=CALLERS):
+    """Call fn() from n threads at once and return their results or exceptions"""
+    results = [None] * n
+    start = threading.Barrier(n)
+
+    def call(i):
+        start.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set('a', 1)
+    clock.now = 9.9
+    assert cache.get('a') == (True, 1)
+    clock.now = 10.0
+    assert cache.get('a') == (False, None)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=3, ttl=10)
+    for key in 'abc':
+        cache.set(key, key)
+    cache.get('a')
+    cache.set('d', 'd')
+    assert [cache.get(key)[0] for key in 'abcd'] == [True, False, True, True]
+    assert len(cache) == 3
+
+
+def test_single_flight_runs_once_for_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+    entered = threading.Semaphore(0)
+
+    def fetch():
+        calls.append(1)
+        # Hold the call open until every caller has had time to join it
+        for _ in range(CALLERS - 1):
+            entered.acquire(timeout=5)
+        time.sleep(0.05)
+        return 'prices'
+
+    def call():
+        entered.release()
+        return flight.do('key', fetch)
+
+    assert run_together(call) == ['prices'] * CALLERS
+    assert len(calls) == 1
+    assert flight._calls == {}
+
+
+def test_single_flight_raises_the_leaders_error_in_every_caller():
+    flight = SingleFlight()
+    entered = threading.Semaphore(0)
+
+    def fetch():
+        for _ in range(CALLERS - 1):
+            entered.acquire(timeout=5)
+        time.sleep(0.05)
+        raise ConnectionError('reset')
+
+    def call():
+        entered.release()
+        return flight.do('key', fetch)
+
+    results = run_together(call)
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert flight.do('key', lambda: 'retried') == 'retried'
+
+
+def test_benchmark_cache_fetches_once_for_concurrent_requests():
+    cache = BenchmarkCache()
+    calls = []
+
+    def fetch(ticker, start_date, end_date):
+        calls.append((ticker, start_date, end_date))
+        time.sleep(0.05)
+        return SyntheticProvider().fetch(ticker, start_date, end_date)
+
+    results = run_together(lambda: cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+    # The same calendar range given as timestamps is the same entry
+    cache.get('^GSPC', '2020-01-01 16:00', '2021-01-01', fetch)
+    assert len(calls) == 1
+
+
+def test_benchmark_cache_does_not_keep_failures():
+    cache = BenchmarkCache()
+    calls = []
+
+    def fetch(ticker, start_date, end_date):
+        calls.append(1)
+        return None if len(calls) == 1 else SyntheticProvider().fetch(ticker, start_date, end_date)
+
+    assert cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch) is None
+    assert len(cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch))
+    assert len(cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch))
+    assert len(calls) == 2
+
+
+def test_benchmark_cache_refetches_after_ttl(clock):
+    cache = BenchmarkCache(ttl=900)
+    calls = []
+
+    def fetch(ticker, start_date, end_date):
+        calls.append(1)
+        return SyntheticProvider().fetch(ticker, start_date, end_date)
+
+    cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch)
+    clock.now = 899
+    cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch)
+    clock.now = 900
+    cache.get('^GSPC', '2020-01-01', '2021-01-01', fetch)
+    assert len(calls) == 2
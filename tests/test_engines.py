@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from conftest import price_frame, random_closes
+from price_data import SyntheticProvider
+from trading_strategy import TradingStrategy
+
+
+def run(engine, stock_data, **params):
+    strategy = TradingStrategy(
+        initial_investment=params.get('initial_investment', 1000.0),
+        shares_small_move=params.get('shares_small_move', 3),
+        shares_large_move=params.get('shares_large_move', 7),
+        consecutive_days=params.get('consecutive_days', 2),
+        stock_symbol='TEST',
+        engine=engine,
+        data_provider=SyntheticProvider(),
+        large_move_threshold=params.get('large_move_threshold', 5)
+    )
+    final_value = strategy.run_reference(stock_data) if engine == 'reference' else strategy.run_vectorized(stock_data)
+    return final_value, list(strategy.portfolio['trades']), strategy.portfolio['cash'], strategy.portfolio['shares']
+
+
+@pytest.mark.parametrize('trial', range(200))
+def test_vectorized_engine_matches_reference(rng, trial):
+    consecutive_days = int(rng.integers(1, 6))
+    stock_data = price_frame(random_closes(rng, int(rng.integers(consecutive_days + 1, 300))))
+    params = dict(
+        initial_investment=float(rng.choice([0.0, 100.0, 1000.0, 25000.0])),
+        shares_small_move=int(rng.integers(0, 5)),
+        shares_large_move=int(rng.integers(0, 20)),
+        consecutive_days=consecutive_days,
+        large_move_threshold=float(rng.choice([0.0, 2.0, 5.0, 100.0]))
+    )
+    assert run('vectorized', stock_data, **params) == run('reference', stock_data, **params)
+
+
+@pytest.mark.parametrize('n_bars', range(0, 5))
+def test_short_series_give_the_same_answer(n_bars):
+    stock_data = price_frame(random_closes(np.random.default_rng(n_bars), n_bars))
+    sp500_data = price_frame(np.full(10, 100.0))
+    results = []
+    for engine in ('reference', 'vectorized'):
+        strategy = TradingStrategy(1000.0, 3, 7, 3, 'TEST', engine=engine, data_provider=SyntheticProvider(),
+                                   plot_mode='lite')
+        result = strategy.analyze(stock_data, sp500_data)
+        results.append({name: result.get(name) for name in ('error', 'final_value', 'number_of_trades')})
+    assert results[0] == results[1]
+    assert (results[0]['error'] is not None) == (n_bars <= 3)
@@ -0,0 +1,39 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import random_closes
+from price_data import SyntheticProvider
+from trading_strategy import TradingStrategy
+
+
+def strategy(consecutive_days, **kwargs):
+    return TradingStrategy(5000.0, 3, 7, consecutive_days, 'TEST', data_provider=SyntheticProvider(), **kwargs)
+
+
+@pytest.mark.parametrize('trial', range(100))
+def test_update_in_chunks_matches_a_single_run(rng, trial):
+    n_bars = int(rng.integers(2, 300))
+    consecutive_days = int(rng.integers(1, 5))
+    stock_data = pd.DataFrame({'Close': random_closes(rng, n_bars)},
+                              index=pd.bdate_range('2010-01-04', periods=n_bars, tz='America/New_York'))
+
+    # Chunks overlap, and the state goes through JSON between them like a stored snapshot
+    incremental = strategy(consecutive_days)
+    trades = []
+    cuts = sorted({0, n_bars, *rng.integers(0, n_bars, int(rng.integers(0, 6))).tolist()})
+    for start, stop in zip(cuts[:-1], cuts[1:]):
+        trades += list(incremental.update(stock_data.iloc[max(0, start - int(rng.integers(0, 3))):stop]))
+        snapshot = json.loads(json.dumps(incremental.snapshot()))
+        incremental = TradingStrategy.from_snapshot(snapshot, data_provider=SyntheticProvider())
+
+    if n_bars <= consecutive_days:
+        assert trades == []
+        assert incremental.state.bars_evaluated == 0
+        return
+    full = strategy(consecutive_days)
+    final_value = full.run_vectorized(stock_data)
+    assert trades == list(full.portfolio['trades'])
+    assert incremental.state.portfolio_value == final_value
+    assert incremental.state.trade_cursor == len(trades)
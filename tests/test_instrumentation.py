@@ -0,0 +1,66 @@
+import re
+
+import instrumentation
+from conftest import ANALYSIS_FORM
+from instrumentation import REQUEST_SECONDS, STAGE_SECONDS
+
+METRICS = ['kailash_stage_duration_seconds', 'kailash_request_duration_seconds', 'kailash_upstream_requests_total',
+           'kailash_upstream_retries_total', 'kailash_fetch_failures_total']
+
+
+def scrape(client):
+    """Return the /metrics samples as a dict of 'name{labels}' -> value"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == instrumentation.REGISTRY.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    for name in METRICS:
+        assert f'# TYPE {name} ' in text
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if line and not line.startswith('#')}
+
+
+def test_analyze_sends_server_timing(client):
+    response = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'})
+    entries = [entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', ')]
+    names = [name for name, _ in entries]
+    assert {'fetch', 'fingerprint', 'simulate', 'plot', 'render'} <= set(names)
+    assert names[-1] == 'total'
+    assert all(re.fullmatch(r'\d+\.\d', duration) for _, duration in entries)
+    durations = {name: float(duration) for name, duration in entries}
+    assert durations['total'] >= durations['simulate']
+
+
+def test_metrics_count_the_request_and_its_stages(client):
+    before = scrape(client)
+    requests = REQUEST_SECONDS.count('analyze', '200')
+    simulations = STAGE_SECONDS.count('simulate')
+    client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'})
+    after = scrape(client)
+
+    assert REQUEST_SECONDS.count('analyze', '200') == requests + 1
+    assert STAGE_SECONDS.count('simulate') == simulations + 1
+    assert after['kailash_request_duration_seconds_count{endpoint="analyze",status="200"}'] == requests + 1
+    assert after['kailash_stage_duration_seconds_count{stage="simulate"}'] == simulations + 1
+    assert after['kailash_stage_duration_seconds_bucket{stage="simulate",le="+Inf"}'] == simulations + 1
+    # Synthetic prices never reach the upstream source
+    assert after['kailash_upstream_requests_total'] == before['kailash_upstream_requests_total']
+
+
+def test_not_modified_responses_are_counted_by_status(client):
+    etag = client.post('/analyze', data=ANALYSIS_FORM).headers['ETag']
+    not_modified = REQUEST_SECONDS.count('analyze', '304')
+    response = client.post('/analyze', data=ANALYSIS_FORM, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Server-Timing' in response.headers
+    assert scrape(client)['kailash_request_duration_seconds_count{endpoint="analyze",status="304"}'] == not_modified + 1
+
+
+def test_disabled_timing_sends_nothing(client, monkeypatch):
+    monkeypatch.setattr(instrumentation, '_enabled', False)
+    requests = REQUEST_SECONDS.count('analyze', '200')
+    response = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+    assert REQUEST_SECONDS.count('analyze', '200') == requests
+    assert client.get('/metrics').status_code == 404
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest_engine import run_backtest
+from conftest import random_closes
+from intraday import import_csv
+from price_data import ColumnarPriceStore, SyntheticProvider
+from trading_strategy import TradingStrategy
+
+
+def minute_bars(n_bars):
+    return pd.date_range('2020-01-02 09:30', periods=n_bars, freq='min', tz='America/New_York')
+
+
+def store_bars(store, index, close):
+    with store.writer('TEST', ['Close'], tz=str(index.tz)) as writer:
+        writer.append(index.tz_convert('UTC').tz_localize(None).values, {'Close': close})
+
+
+@pytest.mark.parametrize('trial', range(60))
+def test_run_intraday_matches_run_backtest(rng, tmp_path, trial):
+    n_bars = int(rng.integers(2, 400))
+    consecutive_days = int(rng.integers(1, 5))
+    chunk_bars = int(rng.integers(1, 50))
+    index, close = minute_bars(n_bars), random_closes(rng, n_bars)
+    store = ColumnarPriceStore(str(tmp_path / 'bars'))
+    store_bars(store, index, close)
+
+    strategy = TradingStrategy(5000.0, 3, 7, consecutive_days, 'TEST', data_provider=SyntheticProvider())
+    summary = strategy.run_intraday(store, str(tmp_path / 'out'), chunk_bars=chunk_bars)
+    if n_bars <= consecutive_days:
+        assert 'error' in summary
+        return
+
+    expected = run_backtest(close, consecutive_days, 3, 7, 5000.0)
+    assert summary['final_value'] == f"${expected['final_value']:,.2f}"
+    assert summary['number_of_trades'] == len(expected['bars'])
+
+    output = ColumnarPriceStore(str(tmp_path / 'out'))
+    equity, _ = output.load('equity')
+    assert str(equity.index.tz) == 'America/New_York'
+    assert equity.index.equals(index[:n_bars - consecutive_days])
+    np.testing.assert_array_equal(equity['equity'], expected['equity'][:n_bars - consecutive_days])
+
+    trades, _ = output.load('trades')
+    assert trades.index.equals(index[expected['bars']])
+    np.testing.assert_array_equal(trades['action'], expected['sides'])
+    np.testing.assert_array_equal(trades['shares'], expected['shares'])
+    np.testing.assert_array_equal(trades['price'], expected['prices'])
+    np.testing.assert_array_equal(trades['price_movement'], expected['moves'])
+
+
+def test_import_csv_in_chunks(rng, tmp_path):
+    index, close = minute_bars(1000), random_closes(rng, 1000)
+    csv_path = tmp_path / 'bars.csv'
+    pd.DataFrame({'Close': close, 'Symbol': 'TEST'}, index=index).to_csv(csv_path)
+
+    store = ColumnarPriceStore(str(tmp_path / 'bars'))
+    assert import_csv(store, 'TEST', str(csv_path), chunk_bars=64) == 1000
+    stored, _ = store.load('TEST')
+    assert list(stored.columns) == ['Close']
+    assert stored.index.equals(index.tz_convert('UTC'))
+    np.testing.assert_array_equal(stored['Close'], close)
@@ -0,0 +1,177 @@
+import json
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import app as app_module
+import jobs
+from conftest import ANALYSIS_FORM
+from jobs import Job, JobManager, JobQueueFull
+
+
+def wait_finished(job, timeout=10):
+    sent = 0
+    while True:
+        events, finished = job.wait_events(sent, timeout=timeout)
+        sent += len(events)
+        if finished or not events:
+            return job
+
+
+def stages(job):
+    return [event['stage'] for event in job.events]
+
+
+def parse_events(text):
+    """Split a Server-Sent Events stream into (event, data) pairs, skipping comments"""
+    messages = []
+    for block in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if fields:
+            messages.append((fields['event'], json.loads(fields['data'])))
+    return messages
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+
+
+def test_job_reports_every_stage_and_its_result():
+    manager = JobManager(workers=1)
+
+    def work(report):
+        report('fetching')
+        report('simulating')
+        return {'answer': 42}
+
+    job = wait_finished(manager.submit(work))
+    assert job.status == 'done' and job.result == {'answer': 42}
+    assert stages(job) == ['queued', 'running', 'fetching', 'simulating', 'done']
+    assert manager.get(job.id) is job
+    assert manager.get('0' * 32) is None
+
+
+def test_failed_job_keeps_its_error():
+    def work(report):
+        raise ValueError('No data available')
+
+    job = wait_finished(JobManager(workers=1).submit(work))
+    assert job.status == 'failed' and job.error == 'No data available'
+    assert job.events[-1]['error'] == 'No data available'
+
+
+def test_full_queue_rejects_jobs():
+    manager = JobManager(workers=1, max_queued=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block(report):
+        started.set()
+        release.wait(10)
+
+    first = manager.submit(block)
+    assert started.wait(10)
+    manager.submit(block)
+    with pytest.raises(JobQueueFull):
+        manager.submit(block)
+    release.set()
+    wait_finished(first)
+
+
+def test_other_processes_follow_jobs_through_the_state_dir(tmp_path, fast_polling):
+    runner, reader = JobManager(workers=1, state_dir=str(tmp_path)), JobManager(state_dir=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+
+    def work(report):
+        started.set()
+        release.wait(10)
+        report('simulating')
+        return {'answer': 42}
+
+    job = runner.submit(work)
+    assert started.wait(10)
+    seen = reader.get(job.id)
+    assert seen is not None and seen is not job
+    assert seen.status == 'running'
+
+    release.set()
+    wait_finished(seen)
+    assert seen.status == 'done' and seen.result == {'answer': 42}
+    assert stages(seen) == ['queued', 'running', 'simulating', 'done']
+    assert reader.get('../' + job.id) is None
+
+
+def test_job_of_an_exited_process_has_failed(tmp_path):
+    job = Job(str(tmp_path))
+    job._save()
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    state = json.loads((tmp_path / f'{job.id}.json').read_text())
+    (tmp_path / f'{job.id}.json').write_text(json.dumps(dict(state, owner=dead.pid)))
+
+    seen = JobManager(state_dir=str(tmp_path)).get(job.id)
+    assert seen.status == 'failed' and seen.finished
+    assert stages(seen) == ['queued', 'failed']
+
+
+def test_pruned_jobs_are_removed_from_the_state_dir(tmp_path):
+    manager = JobManager(workers=1, max_finished=2, state_dir=str(tmp_path))
+    finished = [wait_finished(manager.submit(lambda report: None)) for _ in range(4)]
+    manager.submit(lambda report: None)
+    assert manager.get(finished[0].id) is None
+    assert not (tmp_path / f'{finished[0].id}.json').exists()
+    assert (tmp_path / f'{finished[-1].id}.json').exists()
+
+
+@pytest.fixture
+def job_client(client, monkeypatch, tmp_path, fast_polling):
+    monkeypatch.setattr(app_module, 'JOBS', JobManager(workers=1, state_dir=str(tmp_path)))
+    return client
+
+
+def test_job_routes(job_client):
+    submitted = job_client.post('/jobs', data=ANALYSIS_FORM)
+    assert submitted.status_code == 202
+    urls = submitted.get_json()
+    wait_finished(app_module.JOBS.get(urls['job_id']))
+
+    assert job_client.get(urls['status_url']).get_json()['status'] == 'done'
+    results = job_client.get(urls['result_url']).get_json()
+    analyzed = job_client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'}).get_json()
+    assert results == analyzed
+
+    response = job_client.get(urls['events_url'])
+    assert response.mimetype == 'text/event-stream'
+    messages = parse_events(response.get_data(as_text=True))
+    assert [event for event, _ in messages] == ['progress'] * 6 + ['end']
+    assert [data['stage'] for _, data in messages[:-1]] == ['queued', 'running', 'fetching', 'simulating',
+                                                            'plotting', 'done']
+    assert messages[-1][1]['status'] == 'done' and messages[-1][1]['job_id'] == urls['job_id']
+
+
+def test_job_routes_answer_from_another_worker(job_client, tmp_path, monkeypatch):
+    urls = job_client.post('/jobs', data=ANALYSIS_FORM).get_json()
+    wait_finished(app_module.JOBS.get(urls['job_id']))
+    result = job_client.get(urls['result_url']).get_json()
+
+    # A second worker process only shares the state directory
+    monkeypatch.setattr(app_module, 'JOBS', JobManager(state_dir=str(tmp_path)))
+    assert job_client.get(urls['status_url']).get_json()['status'] == 'done'
+    assert job_client.get(urls['result_url']).get_json() == result
+    messages = parse_events(job_client.get(urls['events_url']).get_data(as_text=True))
+    assert messages[-1][0] == 'end'
+
+
+def test_failed_and_unknown_jobs(job_client):
+    urls = job_client.post('/jobs', data={**ANALYSIS_FORM, 'start_date': '1960-01-01',
+                                          'end_date': '1960-02-01'}).get_json()
+    wait_finished(app_module.JOBS.get(urls['job_id']))
+    failed = job_client.get(urls['result_url'])
+    assert failed.status_code == 500 and failed.get_json()['error']
+    assert parse_events(job_client.get(urls['events_url']).get_data(as_text=True))[-1][1]['status'] == 'failed'
+
+    assert job_client.get('/jobs/' + '0' * 32).status_code == 404
+    assert job_client.get('/jobs/nope/events').status_code == 404
+    assert job_client.post('/jobs', data={'stock_symbol': 'TEST'}).status_code == 400
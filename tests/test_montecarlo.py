@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from backtest_engine import run_backtest
+from conftest import random_closes
+from montecarlo import bootstrap_indices, regime_segments, run_monte_carlo, simulate_paths
+
+
+@pytest.mark.parametrize('trial', range(40))
+def test_simulate_paths_matches_run_backtest(rng, trial):
+    n_paths = int(rng.integers(1, 20))
+    n_bars = int(rng.integers(6, 300))
+    consecutive_days = int(rng.integers(1, 5))
+    threshold = float(rng.choice([0.0, 3.0, 5.0]))
+    small, large = int(rng.integers(0, 5)), int(rng.integers(0, 10))
+    close = np.stack([random_closes(rng, n_bars) for _ in range(n_paths)])
+
+    final_values, max_drawdowns, trades, equity = simulate_paths(close, consecutive_days, small, large, 5000.0,
+                                                                 threshold)
+    for path in range(n_paths):
+        expected = run_backtest(close[path], consecutive_days, small, large, 5000.0, threshold)
+        curve = expected['equity'][:n_bars - consecutive_days]
+        peaks = np.maximum.accumulate(curve)
+        assert final_values[path] == expected['final_value']
+        assert trades[path] == len(expected['bars'])
+        np.testing.assert_array_equal(equity[path], curve)
+        assert max_drawdowns[path] == pytest.approx(((peaks - curve) / peaks).max() * 100)
+
+
+def test_regime_shuffle_keeps_every_regime_once(rng):
+    log_returns = rng.normal(0, 0.01, 1259)
+    segments = regime_segments(log_returns, 20)
+    indices = bootstrap_indices(len(log_returns), 50, len(log_returns), 20, rng, segments)
+
+    labels = np.zeros(len(log_returns), dtype=np.int64)
+    for regime, (start, end) in enumerate(zip(*segments)):
+        labels[start:end] = regime
+    lengths = segments[1] - segments[0]
+    for row in indices:
+        np.testing.assert_array_equal(np.bincount(labels[row], minlength=len(lengths)), lengths)
+
+
+def test_same_seed_gives_the_same_paths(rng):
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 500)))
+    first = run_monte_carlo(close, 10000.0, 5, 10, 2, n_paths=3000, shuffle_regimes=True, seed=7, processes=1)
+    second = run_monte_carlo(close, 10000.0, 5, 10, 2, n_paths=3000, shuffle_regimes=True, seed=7, processes=1)
+    assert first[0].equals(second[0])
+    assert first[1].equals(second[1])
@@ -0,0 +1,241 @@
+import sys
+import types
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import price_data
+from price_data import CachedProvider, PriceDataProvider, SyntheticProvider, YFinanceProvider, fetch_deadline
+from price_data import _subtract_ranges
+
+
+def day(value):
+    return pd.Timestamp(value)
+
+
+def closes(start, end):
+    return SyntheticProvider(seed=3).fetch('TEST', start, end)['Close']
+
+
+class CountingUpstream(PriceDataProvider):
+    """Synthetic upstream that records every range it is asked for
+
+    Ranges listed in fail give None and ranges in empty give no bars.
+    """
+
+    def __init__(self, fail=(), empty=()):
+        self.calls = []
+        self.fail = list(fail)
+        self.empty = list(empty)
+        self.prices = SyntheticProvider(seed=3)
+
+    def fetch(self, ticker, start_date, end_date):
+        self.calls.append((day(start_date), day(end_date)))
+        if (day(start_date), day(end_date)) in self.fail:
+            return None
+        df = self.prices.fetch(ticker, start_date, end_date)
+        return df.iloc[:0] if (day(start_date), day(end_date)) in self.empty else df
+
+
+class FakeClock:
+    """Monotonic clock for price_data that only moves when slept on or advanced"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeYahoo:
+    """Stand-in for the yfinance module whose history() follows a script
+
+    Each call takes latency seconds on the clock, capped at its timeout,
+    then the next outcome: an exception is raised, anything else means
+    the synthetic bars for the range.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.outcomes = []
+        self.latency = 0.0
+        self.calls = []
+
+    def Ticker(self, ticker):
+        return types.SimpleNamespace(history=lambda **kwargs: self.history(ticker, **kwargs))
+
+    def history(self, ticker, start, end, timeout, raise_errors=False):
+        self.calls.append({'at': self.clock.now, 'timeout': timeout, 'raise_errors': raise_errors})
+        self.clock.now += min(self.latency, timeout)
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return SyntheticProvider(seed=3).fetch(ticker, start, end)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(price_data, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def yahoo(monkeypatch, clock):
+    """Install a FakeYahoo as yfinance, scripted through its outcomes"""
+    fake = FakeYahoo(clock)
+    monkeypatch.setitem(sys.modules, 'yfinance', types.SimpleNamespace(Ticker=fake.Ticker))
+    return fake
+
+
+def test_subtract_ranges():
+    covered = [(day('2020-01-10'), day('2020-01-20')), (day('2020-02-01'), day('2020-02-10'))]
+    assert _subtract_ranges(day('2020-01-01'), day('2020-03-01'), covered) == [
+        (day('2020-01-01'), day('2020-01-10')),
+        (day('2020-01-20'), day('2020-02-01')),
+        (day('2020-02-10'), day('2020-03-01'))
+    ]
+    assert _subtract_ranges(day('2020-01-12'), day('2020-01-18'), covered) == []
+    assert _subtract_ranges(day('2020-01-15'), day('2020-01-25'), covered) == [(day('2020-01-20'), day('2020-01-25'))]
+    assert _subtract_ranges(day('2020-01-01'), day('2020-01-05'), []) == [(day('2020-01-01'), day('2020-01-05'))]
+
+
+def test_same_range_is_fetched_once(tmp_path):
+    upstream = CountingUpstream()
+    provider = CachedProvider(upstream, str(tmp_path))
+    first = provider.fetch('TEST', '2020-01-01', '2020-06-01')
+    second = provider.fetch('TEST', '2020-01-01', '2020-06-01')
+    assert upstream.calls == [(day('2020-01-01'), day('2020-06-01'))]
+    assert second.equals(first)
+    assert first['Close'].equals(closes('2020-01-01', '2020-06-01'))
+
+
+def test_overlapping_range_only_fetches_the_gaps(tmp_path):
+    upstream = CountingUpstream()
+    provider = CachedProvider(upstream, str(tmp_path))
+    provider.fetch('TEST', '2020-03-02', '2020-06-01')
+    df = provider.fetch('TEST', '2020-01-01', '2020-09-01')
+    assert upstream.calls[1:] == [
+        (day('2020-01-01'), day('2020-03-02')),
+        (day('2020-06-01'), day('2020-09-01'))
+    ]
+    assert df['Close'].equals(closes('2020-01-01', '2020-09-01'))
+
+    # Another process sees the merged coverage through the shared store
+    other = CountingUpstream()
+    assert len(CachedProvider(other, str(tmp_path)).fetch('TEST', '2020-02-01', '2020-08-01'))
+    assert other.calls == []
+
+
+def test_failed_fetch_is_not_covered(tmp_path):
+    upstream = CountingUpstream(fail=[(day('2020-01-01'), day('2020-06-01'))])
+    provider = CachedProvider(upstream, str(tmp_path))
+    assert provider.fetch('TEST', '2020-01-01', '2020-06-01') is None
+
+    upstream.fail = []
+    assert len(provider.fetch('TEST', '2020-01-01', '2020-06-01'))
+    assert len(upstream.calls) == 2
+
+
+def test_failed_gap_serves_the_cached_bars_and_is_retried(tmp_path):
+    upstream = CountingUpstream(fail=[(day('2020-06-01'), day('2020-09-01'))])
+    provider = CachedProvider(upstream, str(tmp_path))
+    provider.fetch('TEST', '2020-01-01', '2020-06-01')
+    df = provider.fetch('TEST', '2020-01-01', '2020-09-01')
+    assert df['Close'].equals(closes('2020-01-01', '2020-06-01'))
+
+    provider.fetch('TEST', '2020-01-01', '2020-09-01')
+    assert upstream.calls[1:] == [(day('2020-06-01'), day('2020-09-01'))] * 2
+
+
+def test_empty_answer_is_covered(tmp_path):
+    upstream = CountingUpstream(empty=[(day('2020-01-01'), day('2020-06-01'))])
+    provider = CachedProvider(upstream, str(tmp_path))
+    for _ in range(3):
+        assert provider.fetch('TEST', '2020-01-01', '2020-06-01').empty
+    assert len(upstream.calls) == 1
+
+
+def test_weekend_is_not_fetched(tmp_path):
+    upstream = CountingUpstream()
+    assert CachedProvider(upstream, str(tmp_path)).fetch('TEST', '2020-01-04', '2020-01-06').empty
+    assert upstream.calls == []
+
+
+def test_today_is_never_covered(tmp_path):
+    upstream = CountingUpstream()
+    provider = CachedProvider(upstream, str(tmp_path))
+    today = day(datetime.now()).normalize()
+    start, end = today - pd.Timedelta(days=30), today + pd.Timedelta(days=7)
+    provider.fetch('TEST', start, end)
+    provider.fetch('TEST', start, end)
+    assert upstream.calls == [(start, end), (today, end)]
+
+
+def test_yahoo_failures_are_not_covered(tmp_path, yahoo):
+    yahoo.outcomes = [ConnectionError('reset')] * 3
+    provider = CachedProvider(YFinanceProvider(), str(tmp_path))
+    assert provider.fetch('TEST', '2020-01-01', '2020-06-01') is None
+    assert all(call['raise_errors'] for call in yahoo.calls)
+
+    df = provider.fetch('TEST', '2020-01-01', '2020-06-01')
+    assert df['Close'].equals(closes('2020-01-01', '2020-06-01'))
+    assert len(yahoo.calls) == 4
+
+
+def test_yahoo_range_without_bars_is_covered(tmp_path, yahoo):
+    yahoo.outcomes = [Exception('TEST: No price data found, symbol may be delisted (1d 2020-01-01 -> 2020-06-01)')]
+    provider = CachedProvider(YFinanceProvider(), str(tmp_path))
+    assert provider.fetch('TEST', '2020-01-01', '2020-06-01').empty
+    assert provider.fetch('TEST', '2020-01-01', '2020-06-01').empty
+    assert len(yahoo.calls) == 1
+
+
+def test_yahoo_rate_limiting_is_a_failure(tmp_path, yahoo):
+    yahoo.outcomes = [Exception('TEST: No price data found, symbol may be delisted (Yahoo status_code = 429)')] * 3
+    provider = CachedProvider(YFinanceProvider(), str(tmp_path))
+    assert provider.fetch('TEST', '2020-01-01', '2020-06-01') is None
+    assert len(provider.fetch('TEST', '2020-01-01', '2020-06-01'))
+    assert len(yahoo.calls) == 4
+
+
+def test_yahoo_failures_are_retried_with_backoff(yahoo, clock):
+    yahoo.outcomes = [ConnectionError('reset'), Exception('TEST: Yahoo status_code = 429')]
+    provider = YFinanceProvider(max_retries=4, backoff=0.25, max_backoff=2.0)
+    assert len(provider.fetch('TEST', '2020-01-01', '2020-06-01'))
+    assert len(yahoo.calls) == 3
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 0.25 and 0 <= clock.sleeps[1] <= 0.5
+
+
+def test_yahoo_gives_up_after_max_retries(yahoo, clock):
+    yahoo.outcomes = [TimeoutError('read timed out')] * 10
+    assert YFinanceProvider(max_retries=4).fetch('TEST', '2020-01-01', '2020-06-01') is None
+    assert len(yahoo.calls) == 4
+    assert len(clock.sleeps) == 3
+
+
+def test_yahoo_attempts_stop_at_the_deadline(yahoo, clock):
+    yahoo.outcomes = [ConnectionError('reset')] * 10
+    yahoo.latency = 2.0
+    assert YFinanceProvider(max_retries=10, deadline=5.0).fetch('TEST', '2020-01-01', '2020-06-01') is None
+    assert len(yahoo.calls) == 3
+    assert clock.now <= 5.0
+    assert all(call['at'] + call['timeout'] <= 5.0 for call in yahoo.calls)
+
+
+def test_yahoo_attempts_share_the_request_budget(yahoo, clock):
+    yahoo.outcomes = [ConnectionError('reset')] * 10
+    yahoo.latency = 2.0
+    provider = YFinanceProvider(max_retries=10, deadline=5.0)
+    with fetch_deadline(3.0):
+        assert provider.fetch('TEST', '2020-01-01', '2020-06-01') is None
+        assert provider.fetch('TEST', '2020-06-01', '2020-09-01') is None
+    assert len(yahoo.calls) == 2
+    assert clock.now <= 3.0
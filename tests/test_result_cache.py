@@ -0,0 +1,47 @@
+from conftest import ANALYSIS_FORM
+from result_cache import RESULT_CACHE
+
+JSON = {'Accept': 'application/json'}
+
+
+def test_unchanged_analysis_is_not_modified(client):
+    first = client.post('/analyze', data=ANALYSIS_FORM, headers=JSON)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = client.post('/analyze', data=ANALYSIS_FORM, headers={**JSON, 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.data == b''
+
+
+def test_evicted_analysis_is_sent_again(client):
+    first = client.post('/analyze', data=ANALYSIS_FORM, headers=JSON)
+    RESULT_CACHE.clear()
+
+    again = client.post('/analyze', data=ANALYSIS_FORM, headers={**JSON, 'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert again.get_json()['result_id'] == first.get_json()['result_id']
+    assert len(RESULT_CACHE) == 1
+
+
+def test_json_and_html_have_different_etags(client):
+    as_json = client.post('/analyze', data=ANALYSIS_FORM, headers=JSON)
+    as_html = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'text/html'})
+    assert as_json.mimetype == 'application/json' and as_html.mimetype == 'text/html'
+    assert as_json.headers['ETag'] != as_html.headers['ETag']
+
+    # A client holding the JSON copy still gets the page in full
+    page = client.post('/analyze', data=ANALYSIS_FORM,
+                       headers={'Accept': 'text/html', 'If-None-Match': as_json.headers['ETag']})
+    assert page.status_code == 200
+    assert page.headers['ETag'] == as_html.headers['ETag']
+
+
+def test_other_parameters_are_not_matched(client):
+    first = client.post('/analyze', data=ANALYSIS_FORM, headers=JSON)
+    other = client.post('/analyze', data={**ANALYSIS_FORM, 'consecutive_days': '3'},
+                        headers={**JSON, 'If-None-Match': first.headers['ETag']})
+    assert other.status_code == 200
+    assert other.headers['ETag'] != first.headers['ETag']
@@ -0,0 +1,67 @@
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+from price_data import synthetic_prices
+from shared_store import SharedPriceStore
+
+COVERED = [(pd.Timestamp('2000-01-01'), pd.Timestamp('2010-01-01'))]
+
+
+def segment_bytes(root):
+    return sum(os.path.getsize(os.path.join(root, name)) for name in os.listdir(root) if name.startswith('segment-'))
+
+
+def test_round_trip_is_read_only_and_zero_copy(tmp_path):
+    store = SharedPriceStore(str(tmp_path))
+    bars = synthetic_prices(500)
+    bars.index = bars.index.tz_localize('America/New_York')
+    store.save('test', bars, COVERED)
+
+    frame, covered = store.load('TEST')
+    assert frame.equals(bars)
+    assert covered == COVERED
+    close = frame['Close'].to_numpy()
+    assert not close.flags.writeable
+    base = close
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base.obj, mmap.mmap)
+
+
+def test_other_stores_see_saves_at_once(tmp_path):
+    writer, reader = SharedPriceStore(str(tmp_path)), SharedPriceStore(str(tmp_path))
+    assert reader.load('TEST') == (None, [])
+    for n_bars in (100, 200, 300):
+        writer.save('TEST', synthetic_prices(n_bars), COVERED)
+        frame, _ = reader.load('TEST')
+        assert len(frame) == n_bars
+
+
+def test_replaced_records_are_compacted(tmp_path):
+    store = SharedPriceStore(str(tmp_path), segment_size=64 * 1024, compact_threshold=128 * 1024)
+    reader = SharedPriceStore(str(tmp_path))
+    store.save('RARE', synthetic_prices(50, seed=1), COVERED)
+    first, _ = reader.load('RARE')
+
+    for i in range(200):
+        store.save('BUSY', synthetic_prices(1000 + i, seed=i), COVERED)
+    assert segment_bytes(str(tmp_path)) < 128 * 1024 + 2 * 64 * 1024
+
+    # Every symbol survives compaction, and frames loaded before it stay readable
+    assert store.load('RARE')[0].equals(synthetic_prices(50, seed=1))
+    assert store.load('BUSY')[0].equals(synthetic_prices(1199, seed=199))
+    assert first.equals(synthetic_prices(50, seed=1))
+    assert reader.load('BUSY')[0].equals(synthetic_prices(1199, seed=199))
+
+
+def test_compact_keeps_empty_symbols(tmp_path):
+    store = SharedPriceStore(str(tmp_path))
+    store.save('EMPTY', pd.DataFrame(index=pd.DatetimeIndex([], name='Date')), COVERED)
+    store.save('TEST', synthetic_prices(100), COVERED)
+    store.compact()
+    empty, covered = store.load('EMPTY')
+    assert empty.empty and covered == COVERED
+    assert store.load('TEST')[0].equals(synthetic_prices(100))
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest_engine import find_signals
+from conftest import random_closes
+from streak_index import StreakIndex, StreakIndexCache
+
+
+def business_days(n_bars):
+    return pd.bdate_range('2000-01-03', periods=n_bars).values
+
+
+@pytest.mark.parametrize('trial', range(200))
+def test_signals_match_find_signals(rng, trial):
+    n_bars = int(rng.integers(1, 200))
+    close, dates = random_closes(rng, n_bars), business_days(n_bars)
+
+    # Built from the first bars and extended piece by piece as new bars arrive
+    cuts = sorted({1, n_bars, *rng.integers(1, n_bars + 1, 3).tolist()})
+    index = StreakIndex(close[:cuts[0]], dates[:cuts[0]])
+    for start, stop in zip(cuts[:-1], cuts[1:]):
+        index = index.extended(close[start:stop], dates[start:stop])
+    full = StreakIndex(close, dates)
+    for extended, built in zip((index.starts, index.ends, index.up), (full.starts, full.ends, full.up)):
+        np.testing.assert_array_equal(extended, built)
+
+    for _ in range(5):
+        consecutive_days = int(rng.integers(1, 6))
+        start = int(rng.integers(0, n_bars))
+        stop = int(rng.integers(start, n_bars + 1))
+        if stop - start <= consecutive_days:
+            continue
+        expected = find_signals(close[start:stop], consecutive_days, 3, 7, 1.5)
+        found = index.signals(consecutive_days, 3, 7, 1.5, start, stop)
+        for got, want in zip(found, expected):
+            np.testing.assert_array_equal(got, want)
+
+
+def test_cache_extends_and_rebuilds(rng):
+    cache = StreakIndexCache()
+    close, dates = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 3000))), business_days(3000)
+
+    first, offset = cache.get('TEST', dates[:1000], close[:1000])
+    assert (len(first), offset) == (1000, 0)
+    extended, offset = cache.get('TEST', dates[500:1500], close[500:1500])
+    assert (len(extended), offset) == (1500, 500)
+    window, offset = cache.get('TEST', dates[200:300], close[200:300])
+    assert window is extended and offset == 200
+
+    # Revised prices replace the index instead of extending it
+    revised = close.copy()
+    revised[100] += 1
+    rebuilt, offset = cache.get('TEST', dates[:1500], revised[:1500])
+    assert rebuilt is not extended and offset == 0
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from backtest_engine import run_backtest
+from conftest import random_closes
+from sweep import run_sweep, simulate_batch
+
+
+@pytest.mark.parametrize('trial', range(30))
+def test_simulate_batch_matches_run_backtest(rng, trial):
+    close = random_closes(rng, int(rng.integers(10, 300)))
+    consecutive_days = int(rng.integers(1, 5))
+    initial_investment = float(rng.choice([0.0, 500.0, 5000.0]))
+    small = rng.integers(0, 6, 20)
+    large = rng.integers(0, 15, 20)
+    thresholds = rng.choice([0.0, 2.0, 5.0, 50.0], 20)
+
+    final_values, trades = simulate_batch(close, consecutive_days, small, large, thresholds, initial_investment)
+    for i in range(20):
+        result = run_backtest(close, consecutive_days, int(small[i]), int(large[i]), initial_investment,
+                              float(thresholds[i]))
+        assert final_values[i] == result['final_value']
+        assert trades[i] == len(result['bars'])
+
+
+def test_run_sweep_matches_run_backtest(rng):
+    close = random_closes(rng, 400)
+    table = run_sweep(close, 2000.0, [1, 2, 3], [0, 2, 5], [0, 10], [2, 5], processes=1)
+    assert len(table) == 3 * 3 * 2 * 2
+    for row in table.itertuples():
+        result = run_backtest(close, row.consecutive_days, row.shares_small_move, row.shares_large_move, 2000.0,
+                              row.large_move_threshold)
+        assert row.final_value == result['final_value']
+        assert row.number_of_trades == len(result['bars'])
+    assert np.all(np.diff(table['total_return']) <= 0)
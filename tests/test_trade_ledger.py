@@ -0,0 +1,91 @@
+import csv
+import io
+
+import pytest
+
+from conftest import ANALYSIS_FORM, price_frame, random_closes
+from result_cache import RESULT_CACHE
+from trade_ledger import TradeLedger
+from trading_strategy import TradingStrategy
+
+
+def analysis_trades(form):
+    """Trades of the analysis the form describes, run directly rather than through the app"""
+    strategy = TradingStrategy(
+        initial_investment=float(form['initial_investment']),
+        shares_small_move=int(form['shares_small_move']),
+        shares_large_move=int(form['shares_large_move']),
+        consecutive_days=int(form['consecutive_days']),
+        stock_symbol=form['stock_symbol'],
+        start_date=form['start_date'],
+        end_date=form['end_date']
+    )
+    stock_data, sp500_data, error = strategy.get_historical_data()
+    assert error is None
+    assert 'error' not in strategy.analyze(stock_data, sp500_data)
+    return strategy.get_trade_ledger().records()
+
+
+def csv_rows(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    return [{**row, 'shares': int(row['shares'])} for row in csv.DictReader(io.StringIO(response.get_data(as_text=True)))]
+
+
+def test_ledger_formats_like_the_trade_dicts(rng):
+    strategy = TradingStrategy(10000, 10, 20, 2, 'TEST')
+    strategy.run_vectorized(price_frame(random_closes(rng, 3000)))
+    ledger = strategy.get_trade_ledger()
+    assert len(ledger) > 10
+
+    records = ledger.records()
+    assert list(ledger) == records
+    assert ledger[-1] == records[-1] and ledger[3] == records[3]
+    assert ledger[-5:] == records[-5:]
+    with pytest.raises(IndexError):
+        ledger[len(ledger)]
+    assert TradeLedger.from_records(records).records() == records
+
+    text = ''.join(ledger.iter_csv(chunk_size=7))
+    rows = [{**row, 'shares': int(row['shares'])} for row in csv.DictReader(io.StringIO(text))]
+    assert rows == records
+
+
+def test_download_matches_the_analysis(client):
+    results = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'}).get_json()
+    rows = csv_rows(client.get('/download_trades', query_string={'result_id': results['result_id']}))
+    assert rows == analysis_trades(ANALYSIS_FORM)
+    assert len(rows) == results['number_of_trades']
+    assert rows[-5:] == results['last_trades']
+
+    posted = client.post('/download_trades', json={'result_id': results['result_id'], 'format': 'csv'})
+    assert csv_rows(posted) == rows
+
+
+def test_download_is_recomputed_when_the_result_is_gone(client):
+    results = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'}).get_json()
+    cached = client.get('/download_trades', query_string={'result_id': results['result_id']}).get_data()
+
+    # Another worker, or this one after eviction, rebuilds the ledger from the ID alone
+    RESULT_CACHE.clear()
+    response = client.get('/download_trades', query_string={'result_id': results['result_id']})
+    assert response.status_code == 200
+    assert response.get_data() == cached
+
+
+def test_unknown_or_expired_results_are_not_found(client):
+    results = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'}).get_json()
+    key, _, token = results['result_id'].partition('.')
+    RESULT_CACHE.clear()
+
+    for result_id in ['0' * 32, f'{key}.not-base64!', f'{"0" * 32}.{token}', f'{key}.e30']:
+        response = client.get('/download_trades', query_string={'result_id': result_id})
+        assert response.status_code == 404
+        assert 'error' in response.get_json()
+    assert client.get('/download_trades').status_code == 404
+
+
+def test_unknown_format_is_rejected(client):
+    results = client.post('/analyze', data=ANALYSIS_FORM, headers={'Accept': 'application/json'}).get_json()
+    response = client.get('/download_trades', query_string={'result_id': results['result_id'], 'format': 'xlsx'})
+    assert response.status_code == 400
@@ -0,0 +1,155 @@
+import re
+
+import numpy as np
+
+from backtest_engine import BUY, SELL
+
+__all__ = ['TradeLedger']
+
+CSV_COLUMNS = ['date', 'action', 'shares', 'price', 'price_movement']
+
+
+class _ChunkSink:
+    """Write-only file object that hands out what has been written since the last take()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class TradeLedger:
+    """Columnar trade ledger with numeric prices, formatted only when output
+
+    Behaves like the list of trade dicts that analyze() used to build:
+    len(), indexing, slicing and iteration all return formatted trades.
+    """
+
+    def __init__(self, dates, actions, shares, prices, moves):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.actions = np.asarray(actions, dtype=np.int8)
+        self.shares = np.asarray(shares, dtype=np.int64)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.moves = np.asarray(moves, dtype=np.float64)
+
+    @classmethod
+    def from_result(cls, index, result):
+        """Build a ledger from a run_backtest result and the price frame's index"""
+        dates = index[result['bars']]
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        return cls(dates.values, result['sides'], result['shares'], result['prices'], result['moves'])
+
+    @classmethod
+    def from_records(cls, trades):
+        """Build a ledger from formatted trade dicts, as kept by the reference engine
+
+        Prices and moves are parsed back from their two-decimal strings.
+        """
+        def number(text):
+            return float(re.sub(r'[$%,]', '', text))
+
+        return cls(
+            [trade['date'] for trade in trades],
+            [BUY if trade['action'] == 'BUY' else SELL for trade in trades],
+            [trade['shares'] for trade in trades],
+            [number(trade['price']) for trade in trades],
+            [number(trade['price_movement']) for trade in trades]
+        )
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in [self.dates, self.actions, self.shares, self.prices, self.moves])
+
+    def __len__(self):
+        return len(self.shares)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.records(*item.indices(len(self))[:2])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('trade index out of range')
+        return self.records(item, item + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, len(self), 4096):
+            yield from self.records(start, start + 4096)
+
+    def _formatted_columns(self, start, stop):
+        """Format one block of rows as lists of strings and ints"""
+        return (
+            np.datetime_as_string(self.dates[start:stop], unit='D').tolist(),
+            ['BUY' if action == BUY else 'SELL' for action in self.actions[start:stop].tolist()],
+            self.shares[start:stop].tolist(),
+            [f'${price:.2f}' for price in self.prices[start:stop].tolist()],
+            [f'{movement:.2f}%' for movement in self.moves[start:stop].tolist()]
+        )
+
+    def records(self, start=0, stop=None):
+        """Return the trades from start to stop as formatted dicts"""
+        stop = len(self) if stop is None else stop
+        return [
+            dict(zip(CSV_COLUMNS, row))
+            for row in zip(*self._formatted_columns(start, stop))
+        ]
+
+    def iter_csv(self, chunk_size=10000):
+        """Yield the ledger as CSV text, one block of rows at a time"""
+        yield ','.join(CSV_COLUMNS) + '\n'
+        for start in range(0, len(self), chunk_size):
+            rows = zip(*self._formatted_columns(start, start + chunk_size))
+            yield ''.join(f'{date},{action},{shares},{price},{movement}\n'
+                          for date, action, shares, price, movement in rows)
+
+    def iter_parquet(self, chunk_size=65536):
+        """Yield the ledger as a Parquet file with numeric columns, one row group at a time
+
+        Requires pyarrow.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            ('date', pa.date32()),
+            ('action', pa.string()),
+            ('shares', pa.int64()),
+            ('price', pa.float64()),
+            ('price_movement', pa.float64())
+        ])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            for start in range(0, len(self), chunk_size):
+                stop = start + chunk_size
+                writer.write_table(pa.table({
+                    'date': self.dates[start:stop],
+                    'action': np.where(self.actions[start:stop] == BUY, 'BUY', 'SELL'),
+                    'shares': self.shares[start:stop],
+                    'price': self.prices[start:stop],
+                    'price_movement': self.moves[start:stop]
+                }, schema=schema))
+                yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
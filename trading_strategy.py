@@ -1,60 +1,59 @@
-import yfinance as yf
+import contextvars
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import mpld3
-import time
-import requests
-from requests.exceptions import RequestException
 
-__all__ = ['TradingStrategy']
+from backtest_engine import equity_curve, resume_backtest, run_backtest
+from benchmark_cache import BENCHMARK_CACHE
+from instrumentation import span, timed
+from intraday import DEFAULT_CHUNK_BARS, run_intraday
+from plot_payload import build_plot_payload, layout_json
+from price_data import YFinanceProvider, default_provider, fetch_deadline
+from strategy_core import summarize
+from strategy_state import StrategyState
+from streak_index import STREAK_INDEXES
+from trade_ledger import TradeLedger
+
+__all__ = ['FETCH_DEADLINE', 'TradingStrategy']
+
+# Threads for fetches that run alongside the request thread
+_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='fetch')
+
+# Seconds that fetching the stock and the S&P 500 may take together, retries included
+FETCH_DEADLINE = 6.0
 
 class TradingStrategy:
-    def __init__(self, initial_investment, shares_small_move, shares_large_move, consecutive_days, stock_symbol, start_date=None, end_date=None):
+    def __init__(self, initial_investment, shares_small_move, shares_large_move, consecutive_days, stock_symbol, start_date=None, end_date=None, engine='vectorized', data_provider=None, large_move_threshold=5, plot_mode='inline', state=None):
         self.initial_investment = initial_investment
         self.shares_small_move = shares_small_move
         self.shares_large_move = shares_large_move
         self.consecutive_days = consecutive_days
+        # Percentage move at or above which shares_large_move is traded
+        self.large_move_threshold = large_move_threshold
         self.stock_symbol = stock_symbol
         self.start_date = start_date
         self.end_date = end_date
+        # 'vectorized' uses the NumPy engine, 'reference' the original bar-by-bar loop
+        self.engine = engine
+        # 'inline' embeds a full plotly.js figure as HTML, 'lite' returns compact
+        # trace data for a page that loads plotly.js separately
+        self.plot_mode = plot_mode
+        # Where price history comes from, see price_data.default_provider
+        self.data_provider = data_provider or default_provider()
         self.portfolio = {
             'cash': initial_investment,
             'shares': 0,
             'trades': []
         }
+        # Price frame and result of the last simulation core run
+        self._simulation = None
+        # Snapshot advanced by update() as new bars arrive
+        self.state = state or StrategyState(cash=initial_investment)
         
     def fetch_with_retry(self, ticker, start_date, end_date, max_retries=3):
         """Fetch data with retry logic"""
-        for attempt in range(max_retries):
-            try:
-                print(f"Attempt {attempt + 1} to fetch data for {ticker}")
-                # Create a new Ticker instance for each attempt
-                stock = yf.Ticker(ticker)
-                
-                # Try to get info first to validate the ticker
-                info = stock.info
-                if not info:
-                    print(f"No info available for {ticker}")
-                    time.sleep(2)
-                    continue
-                
-                # Fetch the data with a longer timeout
-                df = stock.history(start=start_date, end=end_date, timeout=60)
-                
-                if not df.empty:
-                    print(f"Successfully fetched {len(df)} rows for {ticker}")
-                    return df
-                else:
-                    print(f"Empty dataframe returned for {ticker}")
-                    time.sleep(2)
-            except Exception as e:
-                print(f"Error on attempt {attempt + 1} for {ticker}: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                continue
-        return None
+        return YFinanceProvider(max_retries=max_retries).fetch(ticker, start_date, end_date)
         
     def calculate_price_movement(self, stock_data, start_idx):
         """Calculate the percentage movement over consecutive days"""
@@ -64,33 +63,48 @@ class TradingStrategy:
         
     def get_shares_to_trade(self, price_movement):
         """Determine number of shares to trade based on price movement"""
-        if abs(price_movement) >= 5:
+        if abs(price_movement) >= self.large_move_threshold:
             return self.shares_large_move
         return self.shares_small_move
         
+    def get_date_range(self):
+        """Return the start and end datetimes of the analysis"""
+        if self.start_date is None or self.end_date is None:
+            # Default to 5 years if no dates provided
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=5*365)
+        else:
+            start_date = datetime.strptime(self.start_date, '%Y-%m-%d')
+            end_date = datetime.strptime(self.end_date, '%Y-%m-%d')
+        return start_date, end_date
+        
+    @timed('fetch')
     def get_historical_data(self):
-        """Fetch historical data for the stock and S&P 500"""
+        """Fetch historical data for the stock and S&P 500 within FETCH_DEADLINE seconds"""
+        with fetch_deadline(FETCH_DEADLINE):
+            return self._fetch_historical_data()
+
+    def _fetch_historical_data(self):
         try:
-            if self.start_date is None or self.end_date is None:
-                # Default to 5 years if no dates provided
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=5*365)
-            else:
-                start_date = datetime.strptime(self.start_date, '%Y-%m-%d')
-                end_date = datetime.strptime(self.end_date, '%Y-%m-%d')
+            start_date, end_date = self.get_date_range()
             
             print(f"Fetching data for {self.stock_symbol} from {start_date} to {end_date}")
             
-            # Get stock data with retry
-            stock_df = self.fetch_with_retry(self.stock_symbol, start_date, end_date)
+            # Fetch the S&P 500 in the background while the stock is fetched here,
+            # within the same budget
+            sp500_future = _FETCH_POOL.submit(
+                contextvars.copy_context().run,
+                BENCHMARK_CACHE.get, '^GSPC', start_date, end_date, self.data_provider.fetch
+            )
+            stock_df = self.data_provider.fetch(self.stock_symbol, start_date, end_date)
             if stock_df is None or stock_df.empty:
                 print(f"No data returned for {self.stock_symbol}")
                 return None, None, f'No data available for {self.stock_symbol}'
             
             print(f"Successfully fetched {len(stock_df)} days of stock data")
             
-            # Get S&P 500 data with retry
-            sp500_df = self.fetch_with_retry('^GSPC', start_date, end_date)
+            # The S&P 500 series is shared with every other request in this process
+            sp500_df = sp500_future.result()
             if sp500_df is None or sp500_df.empty:
                 print("No S&P 500 data returned")
                 return None, None, 'Unable to fetch S&P 500 data'
@@ -102,10 +116,20 @@ class TradingStrategy:
             print(f"Error in get_historical_data: {str(e)}")
             return None, None, f'Error fetching data: {str(e)}'
     
-    def analyze(self):
-        """Run the trading strategy analysis"""
+    def analyze(self, stock_data=None, sp500_data=None, progress=None):
+        """Run the trading strategy analysis
+
+        Price data that was already loaded with get_historical_data can be
+        passed in to skip fetching it again. progress, if given, is called
+        with the name of each stage as it starts: 'fetching', 'simulating'
+        and 'plotting'.
+        """
+        report = progress or (lambda stage: None)
+        
         # Get historical data
-        stock_data, sp500_data, error = self.get_historical_data()
+        if stock_data is None or sp500_data is None:
+            report('fetching')
+            stock_data, sp500_data, error = self.get_historical_data()
         
         if stock_data is None or len(stock_data) == 0:
             return {'error': f'No data available for {self.stock_symbol}'}
@@ -113,6 +137,39 @@ class TradingStrategy:
         if sp500_data is None or len(sp500_data) == 0:
             return {'error': 'Unable to fetch S&P 500 data'}
         
+        if len(stock_data) <= self.consecutive_days:
+            return {'error': f'Not enough data for {self.consecutive_days} consecutive days'}
+        
+        # Run the strategy over the closing prices
+        report('simulating')
+        with span('simulate'):
+            if self.engine == 'reference':
+                final_value = self.run_reference(stock_data)
+            else:
+                final_value = self.run_vectorized(stock_data)
+        
+        # Create performance plot
+        report('plotting')
+        with span('plot'):
+            portfolio_values = self.calculate_portfolio_value_over_time(stock_data)
+            if self.plot_mode == 'lite':
+                plot_html = ''
+                plot_data = self.create_plot_payload(stock_data, portfolio_values, sp500_data)
+            else:
+                plot_html = self.create_performance_plot(stock_data, portfolio_values, sp500_data)
+                plot_data = None
+        
+        results = summarize(self.initial_investment, final_value, sp500_data['Close'].to_numpy(), self.portfolio['trades'])
+        results['plot_html'] = plot_html
+        results['plot_data'] = plot_data
+        return results
+    
+    def run_reference(self, stock_data):
+        """Run the strategy bar by bar and return the final portfolio value
+
+        This is the original loop, kept as the reference the vectorized
+        engine is checked against.
+        """
         # Initialize variables
         consecutive_up_days = 0
         consecutive_down_days = 0
@@ -176,136 +233,234 @@ class TradingStrategy:
             last_price = current_price
         
         # Calculate final portfolio value
-        final_value = self.portfolio['cash'] + (self.portfolio['shares'] * last_price)
+        return self.portfolio['cash'] + (self.portfolio['shares'] * last_price)
+
+    def simulate(self, stock_data):
+        """Run the simulation core once per price frame and return its result"""
+        if self._simulation is None or self._simulation[0] is not stock_data:
+            close = stock_data['Close'].to_numpy()
+
+            # The symbol's streaks are encoded once and reused across parameters and date ranges
+            index, offset = STREAK_INDEXES.get(self.stock_symbol, stock_data.index.values, close)
+            result = run_backtest(
+                close,
+                self.consecutive_days,
+                self.shares_small_move,
+                self.shares_large_move,
+                self.initial_investment,
+                self.large_move_threshold,
+                signals=index.signals(self.consecutive_days, self.shares_small_move, self.shares_large_move,
+                                      self.large_move_threshold, offset, offset + len(close))
+            )
+            self._simulation = (stock_data, result)
+        return self._simulation[1]
+    
+    def run_vectorized(self, stock_data):
+        """Run the strategy with the NumPy engine and return the final portfolio value"""
+        result = self.simulate(stock_data)
+        
+        # Trades stay numeric and are only formatted when they are output
+        self.portfolio['trades'] = TradeLedger.from_result(stock_data.index, result)
+        self.portfolio['cash'] = result['cash']
+        self.portfolio['shares'] = result['held']
+        return result['final_value']
+    
+    def get_trade_ledger(self):
+        """Return the trades of the last run as a columnar TradeLedger"""
+        trades = self.portfolio['trades']
+        return trades if isinstance(trades, TradeLedger) else TradeLedger.from_records(trades)
+    
+    def snapshot(self):
+        """Return the parameters and incremental state as JSON-serializable values"""
+        return {
+            'params': {
+                'initial_investment': self.initial_investment,
+                'shares_small_move': self.shares_small_move,
+                'shares_large_move': self.shares_large_move,
+                'consecutive_days': self.consecutive_days,
+                'stock_symbol': self.stock_symbol,
+                'large_move_threshold': self.large_move_threshold
+            },
+            'state': self.state.to_dict()
+        }
+    
+    @classmethod
+    def from_snapshot(cls, snapshot, **kwargs):
+        """Recreate a strategy from snapshot(), ready to continue with update()"""
+        return cls(**snapshot['params'], state=StrategyState.from_dict(snapshot['state']), **kwargs)
+    
+    def update(self, new_bars):
+        """Advance the incremental state with a price frame's new bars and return the trades they produce"""
+        dates = new_bars.index
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        step = self.advance(dates.values, new_bars['Close'].to_numpy(dtype=np.float64))
+        return TradeLedger(step['dates'], step['sides'], step['shares'], step['prices'], step['moves'])
+    
+    def advance(self, dates, closes):
+        """Advance the incremental state over arrays of bar times and closes, returning the fills and equity"""
+        state = self.state
+        dates = np.asarray(dates).astype('datetime64[ns]')
+        closes = np.asarray(closes, dtype=np.float64)
+        # Bars already seen are skipped, so overlapping fetches are fine
+        if state.last_seen is not None:
+            closes = closes[dates > state.last_seen]
+            dates = dates[dates > state.last_seen]
         
-        # Calculate returns
-        total_return = ((final_value - self.initial_investment) / self.initial_investment) * 100
-        sp500_return = ((sp500_data['Close'].iloc[-1] - sp500_data['Close'].iloc[0]) / sp500_data['Close'].iloc[0]) * 100
+        # Global index of the first bar kept in the state's tail
+        offset = state.bars_seen - len(state.tail_closes)
+        tail_closes = np.concatenate([state.tail_closes, closes])
+        tail_dates = np.concatenate([state.tail_dates, dates])
+        bars_seen = state.bars_seen + len(closes)
+        bars_evaluated = max(state.bars_evaluated, bars_seen - self.consecutive_days)
         
-        # Create performance plot
-        portfolio_values = self.calculate_portfolio_value_over_time(stock_data)
-        plot_html = self.create_performance_plot(stock_data, portfolio_values, sp500_data)
+        # Bars evaluated by this call, as positions in the tail
+        evaluated = slice(state.bars_evaluated - offset, bars_evaluated - offset)
+        cash, held = state.cash, state.shares
+        fill_bars = np.empty(0, dtype=np.int64)
+        step = {
+            'sides': np.empty(0, dtype=np.int64),
+            'shares': np.empty(0, dtype=np.int64),
+            'prices': np.empty(0, dtype=np.float64),
+            'moves': np.empty(0, dtype=np.float64),
+            'cash_after': np.empty(0, dtype=np.float64),
+            'held_after': np.empty(0, dtype=np.int64)
+        }
+        if bars_evaluated > state.bars_evaluated:
+            # A fresh run starts at bar 1, since bar 0 has no previous close
+            first_bar = max(state.bars_evaluated, 1)
+            step = resume_backtest(
+                tail_closes, first_bar - offset, self.consecutive_days, self.shares_small_move,
+                self.shares_large_move, state.cash, state.shares, state.consecutive_up_days,
+                state.consecutive_down_days, self.large_move_threshold
+            )
+            fill_bars = step['bars']
+            state.cash = step['cash']
+            state.shares = step['held']
+            state.consecutive_up_days = step['up_days']
+            state.consecutive_down_days = step['down_days']
+            state.last_price = tail_closes[bars_evaluated - 1 - offset].item()
+            state.trade_cursor += len(fill_bars)
         
+        equity = equity_curve(tail_closes[evaluated], fill_bars - evaluated.start, step['cash_after'],
+                              step['held_after'], cash, held)
+        equity_dates = tail_dates[evaluated]
+        fill_dates = tail_dates[fill_bars]
+        
+        # Keep only the closes the next update can still need
+        keep_from = max(0, bars_evaluated - self.consecutive_days)
+        state.tail_closes = tail_closes[keep_from - offset:]
+        state.tail_dates = tail_dates[keep_from - offset:]
+        state.bars_seen = bars_seen
+        state.bars_evaluated = bars_evaluated
+        
+        self.portfolio['cash'] = state.cash
+        self.portfolio['shares'] = state.shares
         return {
-            'initial_investment': f'${self.initial_investment:,.2f}',
-            'final_value': f'${final_value:,.2f}',
-            'total_return': f'{total_return:.2f}%',
-            'sp500_return': f'{sp500_return:.2f}%',
-            'number_of_trades': len(self.portfolio['trades']),
-            'last_trades': self.portfolio['trades'][-5:],
-            'plot_html': plot_html,
-            'all_trades': self.portfolio['trades']
+            'dates': fill_dates,
+            'sides': step['sides'],
+            'shares': step['shares'],
+            'prices': step['prices'],
+            'moves': step['moves'],
+            'equity_dates': equity_dates,
+            'equity': equity
         }
     
+    def refresh(self):
+        """Fetch the bars since the last one seen and advance the state with them"""
+        # Bars are only fetched once, so run this after the close rather than on a partial day
+        start_date, end_date = self.get_date_range()
+        if self.state.last_seen is not None:
+            start_date = pd.Timestamp(self.state.last_seen).to_pydatetime() + timedelta(days=1)
+        if start_date >= end_date:
+            return TradeLedger([], [], [], [], [])
+        
+        new_bars = self.data_provider.fetch(self.stock_symbol, start_date, end_date)
+        if new_bars is None or new_bars.empty:
+            return TradeLedger([], [], [], [], [])
+        return self.update(new_bars)
+    
+    def run_intraday(self, store, output_dir, chunk_bars=DEFAULT_CHUNK_BARS):
+        """Run the strategy over this symbol's bars in a ColumnarPriceStore without loading them whole
+
+        Meant for years of minute bars. The equity curve and trades are
+        written to output_dir, see intraday.run_intraday.
+        """
+        return run_intraday(self, store, self.stock_symbol, output_dir, chunk_bars)
+    
     def calculate_portfolio_value_over_time(self, stock_data):
         """Calculate portfolio value for each day"""
-        portfolio_values = pd.DataFrame(index=stock_data.index)
-        portfolio_values['value'] = self.initial_investment
-        
-        current_shares = 0
-        current_cash = self.initial_investment
-        consecutive_up_days = 0
-        consecutive_down_days = 0
-        last_price = None
-        
-        for i in range(len(stock_data)):
-            current_date = stock_data.index[i]
-            current_price = stock_data['Close'].iloc[i]
-            
-            if last_price is not None:
-                # Check if price increased or decreased
-                if current_price > last_price:
-                    consecutive_up_days += 1
-                    consecutive_down_days = 0
-                else:
-                    consecutive_down_days += 1
-                    consecutive_up_days = 0
-                
-                # Trading logic
-                if consecutive_up_days >= self.consecutive_days:
-                    # Calculate price movement
-                    price_movement = self.calculate_price_movement(stock_data, i - self.consecutive_days + 1)
-                    shares_to_trade = self.get_shares_to_trade(price_movement)
-                    
-                    # Sell if we have shares
-                    if current_shares > 0:
-                        shares_to_sell = min(current_shares, shares_to_trade)
-                        current_cash += shares_to_sell * current_price
-                        current_shares -= shares_to_sell
-                
-                elif consecutive_down_days >= self.consecutive_days:
-                    # Calculate price movement
-                    price_movement = self.calculate_price_movement(stock_data, i - self.consecutive_days + 1)
-                    shares_to_trade = self.get_shares_to_trade(price_movement)
-                    
-                    # Buy if we have enough cash
-                    shares_to_buy = min(
-                        shares_to_trade,
-                        int(current_cash / current_price)
-                    )
-                    if shares_to_buy > 0:
-                        cost = shares_to_buy * current_price
-                        current_cash -= cost
-                        current_shares += shares_to_buy
-            
-            # Update portfolio value for this day
-            portfolio_values.loc[current_date, 'value'] = current_cash + (current_shares * current_price)
-            last_price = current_price
+        result = self.simulate(stock_data)
+        portfolio_values = pd.DataFrame({'value': result['equity']}, index=stock_data.index)
         
         # Calculate percentage change from initial investment
         portfolio_values['pct_change'] = ((portfolio_values['value'] - self.initial_investment) / self.initial_investment) * 100
         return portfolio_values
     
+    def get_performance_series(self, stock_data, portfolio_values, sp500_data):
+        """Return the strategy, S&P 500 and stock returns aligned on common dates"""
+        # Calculate S&P 500 performance
+        sp500_performance = ((sp500_data['Close'] - sp500_data['Close'].iloc[0]) / sp500_data['Close'].iloc[0]) * 100
+        
+        # Calculate stock performance
+        stock_performance = ((stock_data['Close'] - stock_data['Close'].iloc[0]) / stock_data['Close'].iloc[0]) * 100
+        
+        # Ensure dates are aligned
+        common_dates = stock_data.index.intersection(sp500_data.index)
+        portfolio_values = portfolio_values.loc[common_dates]
+        sp500_performance = sp500_performance.loc[common_dates]
+        stock_performance = stock_performance.loc[common_dates]
+        return [
+            ('Strategy Return', portfolio_values['pct_change'], dict(color='green')),
+            ('S&P 500 Return', sp500_performance, dict(color='red', dash='dash')),
+            (f'{self.stock_symbol} Return', stock_performance, dict(color='blue', dash='dot'))
+        ]
+    
+    def get_plot_layout(self):
+        """Return the layout shared by both plot modes"""
+        return dict(
+            title=f'Strategy vs S&P 500 vs {self.stock_symbol} Performance',
+            xaxis_title='Date',
+            yaxis_title='Return (%)',
+            hovermode='x unified',
+            showlegend=True
+        )
+    
     def create_performance_plot(self, stock_data, portfolio_values, sp500_data):
         """Create an interactive plot comparing strategy, S&P 500, and stock returns"""
+        import plotly.graph_objects as go
+
         try:
-            # Calculate S&P 500 performance
-            sp500_performance = ((sp500_data['Close'] - sp500_data['Close'].iloc[0]) / sp500_data['Close'].iloc[0]) * 100
-            
-            # Calculate stock performance
-            stock_performance = ((stock_data['Close'] - stock_data['Close'].iloc[0]) / stock_data['Close'].iloc[0]) * 100
-            
-            # Ensure dates are aligned
-            common_dates = stock_data.index.intersection(sp500_data.index)
-            portfolio_values = portfolio_values.loc[common_dates]
-            sp500_performance = sp500_performance.loc[common_dates]
-            stock_performance = stock_performance.loc[common_dates]
-            
             fig = go.Figure()
             
-            # Add portfolio return line
-            fig.add_trace(go.Scatter(
-                x=portfolio_values.index,
-                y=portfolio_values['pct_change'],
-                name='Strategy Return',
-                line=dict(color='green')
-            ))
-            
-            # Add S&P 500 return line
-            fig.add_trace(go.Scatter(
-                x=sp500_performance.index,
-                y=sp500_performance,
-                name='S&P 500 Return',
-                line=dict(color='red', dash='dash')
-            ))
-            
-            # Add stock return line
-            fig.add_trace(go.Scatter(
-                x=stock_performance.index,
-                y=stock_performance,
-                name=f'{self.stock_symbol} Return',
-                line=dict(color='blue', dash='dot')
-            ))
+            # Add the strategy, S&P 500 and stock return lines
+            for name, performance, line in self.get_performance_series(stock_data, portfolio_values, sp500_data):
+                fig.add_trace(go.Scatter(
+                    x=performance.index,
+                    y=performance,
+                    name=name,
+                    line=line
+                ))
             
-            fig.update_layout(
-                title=f'Strategy vs S&P 500 vs {self.stock_symbol} Performance',
-                xaxis_title='Date',
-                yaxis_title='Return (%)',
-                hovermode='x unified',
-                showlegend=True
-            )
+            fig.update_layout(**self.get_plot_layout())
             
             return fig.to_html(full_html=False)
         except Exception as e:
             print(f"Error creating plot: {str(e)}")
-            return "<p>Error creating performance plot</p>" 
\ No newline at end of file
+            return "<p>Error creating performance plot</p>"
+    
+    def create_plot_payload(self, stock_data, portfolio_values, sp500_data, max_points=1500):
+        """Create a compact plot description for the page to render with a shared plotly.js
+
+        Dates are delta-encoded, values are base64 float32 and long series
+        are downsampled with LTTB to at most max_points points.
+        """
+        try:
+            return build_plot_payload(
+                self.get_performance_series(stock_data, portfolio_values, sp500_data),
+                layout_json(**self.get_plot_layout(), xaxis_type='date'),
+                max_points=max_points
+            )
+        except Exception as e:
+            print(f"Error creating plot payload: {str(e)}")
+            return None